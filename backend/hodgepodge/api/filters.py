@@ -1,22 +1,33 @@
 
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import filters, FilterSet
 
-from recipes.models import Ingredient, Recipe, Tag
+from api.search import search_ingredients
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
+    """Autocomplete: prefix matches first, then substrings, at most
+    search_limit rows."""
+    name = filters.CharFilter(method='filter_name')
+    search_limit = 20
 
     class Meta:
         model = Ingredient
         fields = ('name', )
 
+    def filter_name(self, queryset, name, value):
+        return search_ingredients(queryset, value, self.search_limit)
+
 
 class RecipeFilter(FilterSet):
+    """Tags, favorites and cart are semi-joins: each recipe appears once,
+    without DISTINCT, and the lookups hit the unique indexes."""
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         to_field_name='slug',
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
@@ -27,12 +38,23 @@ class RecipeFilter(FilterSet):
         model = Recipe
         fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
     def filter_is_favorited(self, queryset, name, value):
-        if value:
-            return queryset.filter(in_favorite__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, Favorite, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(shopping_recipe__user=self.request.user)
-        return queryset
+        return self.filter_user_list(queryset, ShoppingCart, value)
+
+    def filter_user_list(self, queryset, model, value):
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            author=user, recipe=OuterRef('pk'))))
@@ -0,0 +1,157 @@
+"""Development aid that catches N+1 queries.
+
+Enabled with the QUERY_INSPECTION setting:
+    'log'   - problems are written to the api.inspection logger;
+    'raise' - a request over its query budget raises QueryBudgetError,
+              so tests that hit it fail.
+
+Every statement is reduced to a fingerprint with literals and IN lists
+collapsed. Fingerprints seen QUERY_REPEAT_THRESHOLD times or more in one
+request are reported together with the serializer fields that were
+being rendered when the statement first ran.
+
+Budgets are declared on the views:
+    query_budgets = {'list': 4, 'retrieve': 3}
+and count every query of the request, authentication and on_commit
+callbacks included. api/tests/test_query_budgets.py runs every budgeted
+action on generated data with the inspection set to 'raise'.
+"""
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.fields import Field
+
+logger = logging.getLogger(__name__)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|\?")
+IN_LISTS = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+SKIPPED_FILES = (
+    __file__, os.path.join(os.path.dirname(__file__), 'metrics.py'))
+
+
+class QueryBudgetError(Exception):
+    pass
+
+
+def fingerprint(sql):
+    sql = LITERALS.sub('?', sql)
+    return SPACES.sub(' ', IN_LISTS.sub('IN (...)', sql)).strip()
+
+
+def find_origin(frame):
+    """Serializer fields being rendered, outermost first, and the
+    innermost frame of project code."""
+    fields, location = [], None
+    while frame is not None:
+        code = frame.f_code
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, Field) and owner.field_name:
+            label = f'{type(owner.parent).__name__}.{owner.field_name}'
+            if not fields or fields[-1] != label:
+                fields.append(label)
+        elif (location is None
+                and code.co_filename.startswith(settings.BASE_DIR)
+                and code.co_filename not in SKIPPED_FILES):
+            location = '{}:{} {}'.format(
+                os.path.relpath(code.co_filename, settings.BASE_DIR),
+                frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return ' → '.join(reversed(fields)) or location or 'unknown'
+
+
+class QueryInspector:
+    """connection.execute_wrapper that counts statements by fingerprint."""
+
+    def __init__(self):
+        self.count = 0
+        self.fingerprints = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.count += 1
+        self.fingerprints[key] += 1
+        if key not in self.origins:
+            self.origins[key] = find_origin(sys._getframe(1))
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        return [
+            (key, count, self.origins[key])
+            for key, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+
+def get_query_budget(view_func, method):
+    """The budget the view declares for the action serving the method."""
+    budgets = getattr(getattr(view_func, 'cls', None), 'query_budgets', None)
+    if not budgets:
+        return None
+    actions = getattr(view_func, 'actions', None) or {}
+    return budgets.get(actions.get(method.lower()))
+
+
+class QueryInspectionMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inspector = QueryInspector()
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(inspector))
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stack.close()
+            raise
+        if response.streaming:
+            response.streaming_content = self.inspect_stream(
+                response.streaming_content, stack, request, inspector)
+            return response
+        stack.close()
+        self.check(request, inspector)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request.method)
+
+    def inspect_stream(self, chunks, stack, request, inspector):
+        try:
+            yield from chunks
+        finally:
+            stack.close()
+        self.check(request, inspector)
+
+    @staticmethod
+    def check(request, inspector):
+        route = f'{request.method} {request.path}'
+        repeated = [
+            f'{count} x {origin}: {key[:300]}'
+            for key, count, origin in inspector.repeated(
+                settings.QUERY_REPEAT_THRESHOLD)
+        ]
+        for line in repeated:
+            logger.warning('Повторяющийся запрос %s: %s', route, line)
+        budget = getattr(request, 'query_budget', None)
+        if budget is None or inspector.count <= budget:
+            return
+        message = '\n'.join([
+            f'{route}: {inspector.count} запросов к БД при бюджете {budget}',
+            *repeated,
+        ])
+        if settings.QUERY_INSPECTION == 'raise':
+            raise QueryBudgetError(message)
+        logger.warning(message)
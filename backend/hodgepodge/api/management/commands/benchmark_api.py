@@ -0,0 +1,316 @@
+import json
+import math
+import platform
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.dataset import EMAIL_DOMAIN, PASSWORD, generate
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+METRICS_MIDDLEWARE = 'api.metrics.MetricsMiddleware'
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1Pe'
+    'AAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC'
+)
+
+
+def percentile(values, share):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """Drives every API route through the test client on generated data.
+
+    For each --sizes value a fresh test database is created, filled by
+    recipes.dataset.generate and torn down afterwards. Every scenario is
+    run --repeat times; latency percentiles, status codes and query
+    counts are written to --output for comparison between commits.
+
+    Each GET is also sent through a client whose middleware chain leaves
+    out MetricsMiddleware, alternating with the instrumented one, so the
+    cost of recording metrics shows up as without_metrics next to the
+    scenario's own numbers.
+    """
+    help = 'Замеряем время ответа и число запросов к БД по всем эндпоинтам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='100,1000',
+            help='Число рецептов, через запятую')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='benchmark.json')
+
+    def handle(self, *args, **options):
+        report = {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'users': options['users'],
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+            },
+            'results': {},
+        }
+        setup_test_environment()
+        try:
+            for size in map(int, options['sizes'].split(',')):
+                self.stdout.write(f'Рецептов: {size}')
+                report['results'][size] = self.run_size(size, options)
+        finally:
+            teardown_test_environment()
+        with open(options['output'], 'w', encoding='UTF-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты записаны в {options["output"]}'))
+
+    def run_size(self, size, options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                    MEDIA_ROOT=media, IMAGE_VARIANT_WORKERS=0):
+                cache.clear()
+                generate(
+                    users=options['users'], recipes=size,
+                    seed=options['seed'])
+                return self.run_scenarios(options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_scenarios(self, repeat):
+        self.prepare(repeat)
+        results = {}
+        for name, method, path, data, client in self.get_scenarios():
+            timings, queries, statuses = [], [], Counter()
+            bare_timings = []
+            for number in range(repeat):
+                payload = data(number) if data else None
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(client(number), method)(
+                        path(number), payload, format='json')
+                    self.consume(response)
+                    timings.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] += 1
+                queries.append(len(context.captured_queries))
+                if name == 'recipes-create' and response.status_code == 201:
+                    self.created.append(response.data['id'])
+                if method == 'get':
+                    started = time.perf_counter()
+                    self.consume(self.bare[client(number)].get(path(number)))
+                    bare_timings.append(
+                        (time.perf_counter() - started) * 1000)
+            results[name] = self.summarize(
+                method, path(0), timings, queries, statuses)
+            line = (f'  {name}: p50 {results[name]["p50_ms"]} мс, '
+                    f'запросов {results[name]["queries_median"]}')
+            if bare_timings:
+                bare = results[name]['without_metrics'] = {
+                    'p50_ms': round(percentile(bare_timings, 0.5), 2),
+                    'p90_ms': round(percentile(bare_timings, 0.9), 2),
+                    'mean_ms': round(statistics.mean(bare_timings), 2),
+                }
+                line += f', без метрик p50 {bare["p50_ms"]} мс'
+            self.stdout.write(line)
+        return results
+
+    @staticmethod
+    def consume(response):
+        """Streamed bodies are produced, and queried, while being read."""
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    @staticmethod
+    def summarize(method, path, timings, queries, statuses):
+        return {
+            'method': method.upper(),
+            'path': path,
+            'status': dict(statuses),
+            'first_ms': round(timings[0], 2),
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p90_ms': round(percentile(timings, 0.9), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'mean_ms': round(statistics.mean(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries_first': queries[0],
+            'queries_median': statistics.median(queries),
+        }
+
+    def prepare(self, repeat):
+        """Picks ids so that write scenarios succeed on every repeat."""
+        self.user = User.objects.filter(
+            email__endswith=EMAIL_DOMAIN).order_by('pk').first()
+        self.client = self.get_client(self.user)
+        self.anon = APIClient()
+        self.admin_user = User.objects.create(
+            username='bench_admin', email='bench_admin@example.com',
+            role=User.ADMIN)
+        self.admin = self.get_client(self.admin_user)
+        self.bare = {
+            self.client: self.without_metrics(self.get_client(self.user)),
+            self.anon: self.without_metrics(APIClient()),
+            self.admin: self.without_metrics(
+                self.get_client(self.admin_user)),
+        }
+        self.recipe = Recipe.objects.order_by('pk').first()
+        self.tag = Tag.objects.order_by('pk').first()
+        self.ingredient = Ingredient.objects.order_by('pk').first()
+        self.free_recipes = list(Recipe.objects.exclude(
+            favorites__author=self.user).exclude(
+            cart__author=self.user).order_by('pk').values_list(
+            'pk', flat=True)[:repeat])
+        self.authors = list(User.objects.exclude(
+            followed__user=self.user).exclude(pk=self.user.pk).order_by(
+            'pk').values_list('pk', flat=True)[:repeat])
+        self.middle_page = max(Recipe.objects.count() // 12, 1)
+        self.created = []
+
+    @staticmethod
+    def get_client(user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    @staticmethod
+    def without_metrics(client):
+        """The client's handler builds its middleware chain once, so
+        building it here leaves MetricsMiddleware out for good."""
+        with override_settings(MIDDLEWARE=[
+                name for name in settings.MIDDLEWARE
+                if name != METRICS_MIDDLEWARE]):
+            client.handler.load_middleware()
+        return client
+
+    def new_recipe(self, number):
+        return {
+            'name': f'benchmark {number}',
+            'text': 'benchmark',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+        }
+
+    def get_scenarios(self):
+        """(name, method, path(i), data(i) or None, client(i)).
+
+        Scenarios run in this order; writes are paired with the requests
+        that undo them so the dataset stays the same between sizes.
+        """
+        user = lambda number: self.client  # noqa: E731
+        anon = lambda number: self.anon  # noqa: E731
+        admin = lambda number: self.admin  # noqa: E731
+        recipe = f'/api/recipes/{self.recipe.pk}/'
+        free = self.free_recipes
+        created = lambda number: f'/api/recipes/{self.created[number]}/'  # noqa: E731,E501
+        bulk = lambda number: {'recipes': free}  # noqa: E731
+        return [
+            ('tags-list', 'get', lambda n: '/api/tags/', None, anon),
+            ('tags-detail', 'get',
+             lambda n: f'/api/tags/{self.tag.pk}/', None, anon),
+            ('ingredients-list', 'get',
+             lambda n: '/api/ingredients/', None, anon),
+            ('ingredients-search', 'get',
+             lambda n: '/api/ingredients/?name=ингр', None, anon),
+            ('ingredients-detail', 'get',
+             lambda n: f'/api/ingredients/{self.ingredient.pk}/', None,
+             anon),
+            ('recipes-list-anon', 'get',
+             lambda n: '/api/recipes/?page=1&limit=6', None, anon),
+            ('recipes-list', 'get',
+             lambda n: '/api/recipes/?page=1&limit=6', None, user),
+            ('recipes-list-middle', 'get',
+             lambda n: f'/api/recipes/?page={self.middle_page}&limit=6',
+             None, user),
+            ('recipes-list-cursor', 'get',
+             lambda n: '/api/recipes/?cursor=&limit=6', None, user),
+            ('recipes-list-tags', 'get',
+             lambda n: f'/api/recipes/?tags={self.tag.slug}', None, user),
+            ('recipes-list-favorited', 'get',
+             lambda n: '/api/recipes/?is_favorited=1', None, user),
+            ('recipes-list-in-cart', 'get',
+             lambda n: '/api/recipes/?is_in_shopping_cart=1', None, user),
+            ('recipes-list-author', 'get',
+             lambda n: f'/api/recipes/?author={self.user.pk}', None, user),
+            ('recipes-detail', 'get', lambda n: recipe, None, user),
+            ('recipes-create', 'post',
+             lambda n: '/api/recipes/', self.new_recipe, user),
+            ('recipes-update', 'patch', created, self.new_recipe, user),
+            ('recipes-delete', 'delete', created, None, user),
+            ('recipes-favorite-add', 'post',
+             lambda n: f'/api/recipes/{free[n]}/favorite/', None, user),
+            ('recipes-favorite-remove', 'delete',
+             lambda n: f'/api/recipes/{free[n]}/favorite/', None, user),
+            ('recipes-cart-add', 'post',
+             lambda n: f'/api/recipes/{free[n]}/shopping_cart/', None, user),
+            ('recipes-cart-remove', 'delete',
+             lambda n: f'/api/recipes/{free[n]}/shopping_cart/', None,
+             user),
+            ('recipes-favorite-bulk-add', 'post',
+             lambda n: '/api/recipes/favorite/', bulk, user),
+            ('recipes-favorite-bulk-remove', 'delete',
+             lambda n: '/api/recipes/favorite/', bulk, user),
+            ('recipes-cart-bulk-add', 'post',
+             lambda n: '/api/recipes/shopping_cart/', bulk, user),
+            ('recipes-download-txt', 'get',
+             lambda n: '/api/recipes/download_shopping_cart/', None, user),
+            ('recipes-download-csv', 'get',
+             lambda n: '/api/recipes/download_shopping_cart/?format=csv',
+             None, user),
+            ('recipes-download-pdf', 'get',
+             lambda n: '/api/recipes/download_shopping_cart/?format=pdf',
+             None, user),
+            ('recipes-cart-bulk-remove', 'delete',
+             lambda n: '/api/recipes/shopping_cart/', bulk, user),
+            ('users-list', 'get',
+             lambda n: '/api/users/?page=1&limit=6', None, user),
+            ('users-detail', 'get',
+             lambda n: f'/api/users/{self.user.pk}/', None, user),
+            ('users-me', 'get', lambda n: '/api/users/me/', None, user),
+            ('users-create', 'post', lambda n: '/api/users/',
+             lambda n: {
+                 'email': f'new{n}{EMAIL_DOMAIN}', 'username': f'new{n}',
+                 'first_name': 'Имя', 'last_name': 'Фамилия',
+                 'password': PASSWORD,
+             }, anon),
+            ('users-subscribe', 'post',
+             lambda n: f'/api/users/{self.authors[n]}/subscribe/', None,
+             user),
+            ('users-subscriptions', 'get',
+             lambda n: '/api/users/subscriptions/', None, user),
+            ('users-unsubscribe', 'delete',
+             lambda n: f'/api/users/{self.authors[n]}/subscribe/', None,
+             user),
+            ('users-set-password', 'post',
+             lambda n: '/api/users/set_password/',
+             lambda n: {
+                 'current_password': PASSWORD, 'new_password': PASSWORD,
+             }, user),
+            ('metrics', 'get', lambda n: '/api/metrics/', None, admin),
+            ('auth-login', 'post', lambda n: '/api/auth/token/login/',
+             lambda n: {'email': self.user.email, 'password': PASSWORD},
+             anon),
+            # Every logout needs a fresh token, so this one goes last.
+            ('auth-logout', 'post', lambda n: '/api/auth/token/logout/',
+             None, lambda n: self.get_client(self.user)),
+        ]
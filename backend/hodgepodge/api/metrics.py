@@ -0,0 +1,215 @@
+"""Per-route request metrics in the Prometheus text format.
+
+Every thread writes to its own table of counters, so recording a request
+takes no lock; render() sums the tables of all threads of the process.
+Each worker process keeps its own numbers, which start again from zero
+when the worker is restarted.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.db import connections
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'hodgepodge'
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_local = threading.local()
+_tables = []
+
+
+class RouteStats:
+    __slots__ = ('statuses', 'latency', 'seconds', 'queries', 'query_count',
+                 'db_seconds', 'response_bytes')
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.seconds = 0.0
+        self.queries = [0] * (len(QUERY_BUCKETS) + 1)
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.response_bytes = 0
+
+    def add(self, status, seconds, probe, size):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.seconds += seconds
+        self.queries[bisect_left(QUERY_BUCKETS, probe.count)] += 1
+        self.query_count += probe.count
+        self.db_seconds += probe.seconds
+        self.response_bytes += size
+
+    def merge(self, other):
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency = [a + b for a, b in zip(self.latency, other.latency)]
+        self.queries = [a + b for a, b in zip(self.queries, other.queries)]
+        self.seconds += other.seconds
+        self.query_count += other.query_count
+        self.db_seconds += other.db_seconds
+        self.response_bytes += other.response_bytes
+
+
+def get_table():
+    """The counters of the current thread."""
+    try:
+        return _local.table
+    except AttributeError:
+        _local.table = {}
+        _tables.append(_local.table)
+        return _local.table
+
+
+def record(route, method, status, seconds, probe, size):
+    table = get_table()
+    stats = table.get((route, method))
+    if stats is None:
+        stats = table[(route, method)] = RouteStats()
+    stats.add(status, seconds, probe, size)
+
+
+def collect():
+    """Counters of all threads summed per (route, method)."""
+    total = {}
+    for table in list(_tables):
+        for key, stats in list(table.items()):
+            total.setdefault(key, RouteStats()).merge(stats)
+    return total
+
+
+class QueryProbe:
+    """connection.execute_wrapper that counts queries and their time."""
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Records every request under its resolved URL name.
+
+    Streaming responses are recorded once their content is consumed, so
+    the queries and time spent while streaming are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        probe = QueryProbe()
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(probe))
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            stack.close()
+            raise
+
+        def finish(size):
+            stack.close()
+            match = request.resolver_match
+            record(
+                match.view_name if match else 'unmatched', request.method,
+                response.status_code, time.perf_counter() - started,
+                probe, size)
+
+        if response.streaming:
+            response.streaming_content = self.measure(
+                response.streaming_content, finish)
+        else:
+            finish(len(response.content))
+        return response
+
+    @staticmethod
+    def measure(chunks, finish):
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            finish(size)
+
+
+def format_labels(**labels):
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_histogram(name, buckets, counts, total, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets + ('+Inf',), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{format_labels(**labels, le=bound)} '
+                     f'{cumulative}')
+    lines.append(f'{name}_sum{format_labels(**labels)} {total}')
+    lines.append(f'{name}_count{format_labels(**labels)} {cumulative}')
+    return lines
+
+
+METRICS = (
+    ('http_requests_total', 'counter',
+     'Обработано запросов по маршруту, методу и статусу.'),
+    ('http_request_duration_seconds', 'histogram',
+     'Время ответа в секундах.'),
+    ('db_queries_per_request', 'histogram',
+     'Запросов к БД на один HTTP запрос.'),
+    ('db_duration_seconds_total', 'counter',
+     'Время выполнения запросов к БД в секундах.'),
+    ('http_response_size_bytes_total', 'counter',
+     'Отдано байт в теле ответа.'),
+)
+
+
+def get_lines(name, key, stats):
+    labels = {'route': key[0], 'method': key[1]}
+    if name == 'http_requests_total':
+        return [
+            f'{PREFIX}_{name}{format_labels(**labels, status=status)} '
+            f'{count}'
+            for status, count in sorted(stats.statuses.items())
+        ]
+    if name == 'http_request_duration_seconds':
+        return format_histogram(
+            f'{PREFIX}_{name}', LATENCY_BUCKETS, stats.latency,
+            stats.seconds, labels)
+    if name == 'db_queries_per_request':
+        return format_histogram(
+            f'{PREFIX}_{name}', QUERY_BUCKETS, stats.queries,
+            stats.query_count, labels)
+    value = (stats.db_seconds if name == 'db_duration_seconds_total'
+             else stats.response_bytes)
+    return [f'{PREFIX}_{name}{format_labels(**labels)} {value}']
+
+
+def render():
+    """All metrics of the process in the Prometheus text format."""
+    routes = sorted(collect().items())
+    lines = []
+    for name, kind, description in METRICS:
+        lines.append(f'# HELP {PREFIX}_{name} {description}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        for key, stats in routes:
+            lines.extend(get_lines(name, key, stats))
+    return '\n'.join(lines) + '\n'
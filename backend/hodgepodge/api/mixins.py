@@ -0,0 +1,95 @@
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.serializers import ListSerializer
+
+from recipes.cache import get_version, user_version_name
+
+
+def get_requested_fields(request, available):
+    """Names from available left after ?fields= and ?omit= are applied.
+
+    Only GET requests are pruned, so write responses stay complete.
+    """
+    names = list(available)
+    if request is None or request.method != 'GET':
+        return names
+    fields = request.query_params.get('fields')
+    if fields:
+        keep = set(fields.split(','))
+        names = [name for name in names if name in keep]
+    omit = request.query_params.get('omit')
+    if not omit:
+        return names
+    drop = set(omit.split(','))
+    return [name for name in names if name not in drop]
+
+
+class SparseFieldsetMixin:
+    """Serializer that drops top-level fields per ?fields= / ?omit=.
+
+    Nested serializers keep all their fields.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        names = get_requested_fields(self.context.get('request'), fields)
+        return type(fields)((name, fields[name]) for name in names)
+
+
+class ConditionalGetMixin:
+    """Adds ETag / Last-Modified to list and retrieve and answers
+    conditional requests with 304 before the queryset is built.
+
+    Validators come from the version stamp of version_name, bumped by the
+    signal receivers on every write. For views with personal_state the
+    viewer's own stamp is mixed in, so favorites, cart and subscriptions
+    invalidate only that viewer's validators.
+    """
+    version_name = None
+    personal_state = True
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            self.get_list_validator(), super().list,
+            request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            self.get_detail_validator(), super().retrieve,
+            request, *args, **kwargs)
+
+    def get_list_validator(self):
+        return get_version(self.version_name)
+
+    def get_detail_validator(self):
+        return get_version(self.version_name)
+
+    def conditional(self, validator, handler, request, *args, **kwargs):
+        if validator is None:
+            return handler(request, *args, **kwargs)
+        parts = [validator, request.build_absolute_uri()]
+        last_modified = None
+        if self.personal_state and request.user.is_authenticated:
+            parts.append(get_version(user_version_name(request.user.pk)))
+        elif isinstance(validator, datetime):
+            last_modified = int(validator.timestamp())
+        etag = quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization', ))
+        return response
@@ -1,6 +1,283 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import partial
+from operator import attrgetter
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.cache import get_version, user_version_name
+
+MAX_PAGE_SIZE = 100
+
+
+class EstimatedPage(Page):
+    """Page that knows from its own rows whether another one follows."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountingPaginator(Paginator):
+    """Paginator that takes its total from a counter callable.
+
+    The counter returns (count, estimated). A planner estimate can be
+    lower than the real count, so with one the page number is not checked
+    against num_pages and a next page exists when one more row than the
+    page holds is found.
+    """
+
+    def __init__(self, object_list, per_page, counter, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+
+    @cached_property
+    def totals(self):
+        return self.counter(self.object_list)
+
+    @property
+    def count(self):
+        return self.totals[0]
+
+    @property
+    def estimated(self):
+        return self.totals[1]
+
+    def validate_number(self, number):
+        if not self.estimated:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if not self.estimated:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedPage(
+            rows[:self.per_page], number, self,
+            has_next=len(rows) > self.per_page)
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over the view's cursor_ordering.
+
+    The ordering must end with a unique field, e.g. ('-created', '-id').
+    Pages are selected with a row comparison against the last row seen,
+    so deep pages cost the same as the first one and no COUNT(*) is run.
+    """
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = ('-created', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(queryset.model, request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_position_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """(a, b) < (x, y) spelled as a < x OR (a = x AND b < y)."""
+        query = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            query |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return query
+
+    def encode_cursor(self, obj, reverse):
+        position = [
+            str(attrgetter(field.lstrip('-'))(obj)) for field in self.ordering
+        ]
+        payload = json.dumps({'p': position, 'r': int(reverse)})
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, model, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()))
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, payload['p'])
+            ]
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
 
 
 class CustomPagination(PageNumberPagination):
+    """Page/limit pagination with an opt-in keyset mode.
+
+    Views that declare cursor_ordering switch to KeysetPagination when
+    the request carries a cursor parameter; an empty ?cursor= asks for
+    the first page.
+
+    Totals are cached per filter and collection version for a short
+    time. On PostgreSQL result sets above count_estimate_threshold are
+    counted by the planner instead, and the response says so in
+    count_estimated.
+    """
     page_size_query_param = 'limit'
     page_size = 6
+    max_page_size = MAX_PAGE_SIZE
+    keyset_pagination_class = KeysetPagination
+    keyset = None
+    count_cache_timeout = 60
+    count_estimate_threshold = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        keyset = self.keyset_pagination_class()
+        if (hasattr(view, 'cursor_ordering')
+                and keyset.cursor_query_param in request.query_params):
+            self.keyset = keyset
+            return keyset.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = partial(
+            CountingPaginator,
+            counter=partial(self.get_count, request=request, view=view))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        response = super().get_paginated_response(data)
+        response.data['count_estimated'] = self.page.paginator.estimated
+        return response
+
+    def get_count(self, queryset, request, view):
+        """(count, estimated) of the filtered queryset."""
+        try:
+            key = self.get_count_cache_key(queryset, request, view)
+        except EmptyResultSet:
+            return 0, False
+        result = cache.get(key)
+        if result is None:
+            result = self.estimate_count(queryset)
+            if result is None:
+                result = (queryset.count(), False)
+            cache.set(key, result, self.count_cache_timeout)
+        return result
+
+    def get_count_cache_key(self, queryset, request, view):
+        """Normalized SQL of the filtered queryset plus the versions of
+        everything that can change its size."""
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        versions = [get_version(queryset.model._meta.label_lower)]
+        personal_filters = getattr(view, 'personal_filters', ())
+        if request.user.is_authenticated and (
+                set(personal_filters) & set(request.query_params)):
+            versions.append(get_version(user_version_name(request.user.pk)))
+        digest = hashlib.md5(
+            repr((sql, params, versions)).encode()).hexdigest()
+        return f'count:{digest}'
+
+    def estimate_count(self, queryset):
+        """Planner row estimate, or None when an exact count is cheap."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            if queryset.query.has_filters():
+                sql, params = (
+                    queryset.order_by().values('pk').query.sql_with_params())
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = plan[0]['Plan']['Plan Rows']
+            else:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table])
+                estimate = cursor.fetchone()[0]
+        if estimate < self.count_estimate_threshold:
+            return None
+        return int(estimate), True
@@ -21,3 +21,10 @@ class IsCurrentUserOrAdminOrReadOnly(permissions.BasePermission):
             return True
         return (obj.id == request.user
                 or request.user.is_superuser)
+
+
+class IsAdmin(permissions.BasePermission):
+    """Only for users with the admin role and superusers."""
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and (
+            request.user.admin or request.user.is_superuser)
@@ -0,0 +1,71 @@
+from bisect import bisect_left
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
+
+from recipes.cache import get_version
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """In-process index of the ingredient catalogue.
+
+    Used where the database has no trigram index: lowercased names are
+    kept sorted, so prefix matches are a bisect and substring matches a
+    pass over ~2000 short strings. The index is rebuilt when the
+    ingredient version stamp changes.
+    """
+
+    def __init__(self):
+        self.state = (None, [], [])
+
+    def get_state(self):
+        version = get_version(Ingredient._meta.label_lower)
+        if self.state[0] != version:
+            rows = sorted(
+                (name.lower(), pk)
+                for pk, name in Ingredient.objects.values_list('id', 'name'))
+            self.state = (
+                version, [name for name, _ in rows], [pk for _, pk in rows])
+        return self.state
+
+    def search(self, term, limit):
+        """Ids of prefix matches first, then substring matches."""
+        _, names, ids = self.get_state()
+        term = term.lower()
+        found = []
+        start = bisect_left(names, term)
+        for position in range(start, len(names)):
+            if len(found) == limit or not names[position].startswith(term):
+                break
+            found.append(ids[position])
+        if len(found) == limit:
+            return found
+        for position, name in enumerate(names):
+            if term in name and not name.startswith(term):
+                found.append(ids[position])
+                if len(found) == limit:
+                    break
+        return found
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(queryset, term, limit):
+    """Ranked autocomplete: prefix matches, then substrings, capped."""
+    if connections[queryset.db].vendor == 'postgresql':
+        return queryset.filter(name__icontains=term).annotate(
+            rank=Case(
+                When(name__istartswith=term, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('rank', 'name')[:limit]
+    ids = ingredient_index.search(term, limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).order_by(Case(
+        *[When(pk=pk, then=Value(rank)) for rank, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    ))
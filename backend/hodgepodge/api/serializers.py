@@ -1,10 +1,57 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Manager, prefetch_related_objects
 from rest_framework import serializers
 
+from api.mixins import SparseFieldsetMixin
 from api.utils import Base64ImageField
+from recipes.counters import change_counter
+from recipes.images import VARIANT_SIZES, get_variant
 from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.signals import bulk_write
+from users.models import User
 from users.serializers import UserSerializer
 
+FRAGMENT_KEY = 'recipe:v1:{}:{}:{}'
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+MAX_BULK_RECIPES = 100
+
+
+class RecipeImageField(serializers.Field):
+    """URL of a resized recipe image, or of every variant when no size
+    is given. The original is used until the variants are rendered."""
+    kinds = ('default', 'webp')
+
+    def __init__(self, size=None, **kwargs):
+        self.size = size
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        if self.size is not None:
+            return self.get_url(get_variant(recipe, self.size))
+        return {
+            size: {
+                kind: self.get_url(get_variant(recipe, size, kind))
+                for kind in self.kinds
+            }
+            for size in VARIANT_SIZES
+        }
+
+    def get_url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
 
 class FavoriteSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(
@@ -71,7 +118,42 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeFragmentListSerializer(serializers.ListSerializer):
+    """Reads a page of recipe fragments from the cache in one round-trip
+    and renders only the missing ones."""
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else list(data)
+        keys = [self.child.get_fragment_key(recipe) for recipe in recipes]
+        fragments = cache.get_many(keys)
+        missing = [
+            (key, recipe) for key, recipe in zip(keys, recipes)
+            if key not in fragments
+        ]
+        if missing:
+            prefetch_related_objects(
+                [recipe for _, recipe in missing],
+                *Recipe.objects.representation_prefetch(self.child.fields))
+            rendered = {
+                key: self.child.get_fragment(recipe)
+                for key, recipe in missing
+            }
+            cache.set_many(rendered, FRAGMENT_TIMEOUT)
+            fragments.update(rendered)
+        return [
+            self.child.add_personal_fields(fragments[key], recipe)
+            for key, recipe in zip(keys, recipes)
+        ]
+
+
+class RecipeListSerializer(SparseFieldsetMixin,
+                           serializers.ModelSerializer):
+    """Recipe card.
+
+    Everything except is_favorited, is_in_shopping_cart and
+    author.is_subscribed is cached per recipe under its updated stamp
+    and field set; the personal flags are layered on for every response.
+    """
     author = UserSerializer()
     tags = TagSerializer(
         many=True,
@@ -82,14 +164,62 @@ class RecipeListSerializer(serializers.ModelSerializer):
         read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    images = RecipeImageField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'images', 'text', 'cooking_time')
+        list_serializer_class = RecipeFragmentListSerializer
+
+    def to_representation(self, instance):
+        key = self.get_fragment_key(instance)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = self.get_fragment(instance)
+            cache.set(key, fragment, FRAGMENT_TIMEOUT)
+        return self.add_personal_fields(fragment, instance)
+
+    def get_fragment_key(self, instance):
+        # Image URLs are absolute, so the host is part of the key.
+        base_url = self.context['request'].build_absolute_uri('/')
+        variant = repr((base_url, list(self.fields)))
+        return FRAGMENT_KEY.format(
+            instance.pk,
+            instance.updated.timestamp(),
+            hashlib.md5(variant.encode()).hexdigest()[:8])
+
+    def get_fragment(self, instance):
+        """Representation with the personal flags still to be set."""
+        prefetch_related_objects(
+            [instance], *Recipe.objects.representation_prefetch(self.fields))
+        if 'author' in self.fields and hasattr(
+                instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
+    def add_personal_fields(self, fragment, instance):
+        data = fragment.copy()
+        if 'is_favorited' in data:
+            data['is_favorited'] = self.get_is_favorited(instance)
+        if 'is_in_shopping_cart' in data:
+            data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(
+                instance)
+        if 'author' in data:
+            data['author'] = fragment['author'].copy()
+            data['author']['is_subscribed'] = self.get_author_is_subscribed(
+                instance)
+        return data
+
+    def get_author_is_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        return self.fields['author'].get_is_subscribed(obj.author)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
@@ -97,6 +227,8 @@ class RecipeListSerializer(serializers.ModelSerializer):
         return favorite.exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
@@ -105,8 +237,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
 
 
 class IngredientAddSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -115,12 +246,24 @@ class IngredientAddSerializer(serializers.ModelSerializer):
 
 
 class RecipeSmallSerializer(serializers.ModelSerializer):
+    image = RecipeImageField(size='small')
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'cooking_time', 'image')
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Payload of the bulk favorite / shopping cart endpoints."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES)
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients = IngredientAddSerializer(
         many=True,
@@ -137,12 +280,27 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         fields = ('ingredients', 'tags', 'image',
                   'name', 'text', 'cooking_time', 'author')
 
+    def validate_ingredients(self, value):
+        """Checks every ingredient id with one query and reports unknown
+        ones per item, as PrimaryKeyRelatedField did."""
+        found = set(Ingredient.objects.filter(
+            pk__in=[item['id'] for item in value]).values_list(
+            'pk', flat=True))
+        if all(item['id'] in found for item in value):
+            return value
+        message = serializers.PrimaryKeyRelatedField.default_error_messages[
+            'does_not_exist']
+        raise serializers.ValidationError([
+            {} if item['id'] in found else {'id': [serializers.ErrorDetail(
+                message.format(pk_value=item['id']), code='does_not_exist')]}
+            for item in value
+        ])
+
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = data.get('ingredients', [])
         list = []
         for ingredient in ingredients:
-            amount = ingredient['amount']
-            if int(amount) < 1:
+            if ingredient['amount'] < 1:
                 raise serializers.ValidationError({
                     'amount': 'Amount should be more than 0!'
                 })
@@ -165,30 +323,67 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             tags_list.append(tag)
         return data
 
-    def to_representation(self, instance):
-        ingredients = super().to_representation(instance)
-        ingredients['ingredients'] = IngredientAmountSerializer(
-            instance.amount.all(), many=True).data
-        return ingredients
-
-    def add_tags_ingredients(self, ingredients, tags, model):
-        for ingredient in ingredients:
-            IngredientAmount.objects.update_or_create(
-                recipe=model,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount'])
-        model.tags.set(tags)
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
 
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_representation(
+            request.user).get(pk=instance.pk)
+        return RecipeListSerializer(instance, context=self.context).data
+
+    def set_ingredients(self, recipe, ingredients, existing=True):
+        """Brings the recipe's rows in line with the payload using at most
+        one INSERT, one UPDATE and one DELETE.
+
+        Returns {ingredient id: change in amount}.
+        """
+        wanted = {item['id']: item['amount'] for item in ingredients}
+        current = {}
+        if existing:
+            current = {row.ingredient_id: row for row in recipe.amount.all()}
+        before = {pk: row.amount for pk, row in current.items()}
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in wanted.items() if pk not in current
+        ])
+        changed = []
+        for pk, row in current.items():
+            if pk in wanted and row.amount != wanted[pk]:
+                row.amount = wanted[pk]
+                changed.append(row)
+        IngredientAmount.objects.bulk_update(changed, ['amount'])
+        removed = current.keys() - wanted.keys()
+        if removed:
+            recipe.amount.filter(ingredient_id__in=removed).delete()
+        return {
+            pk: wanted.get(pk, 0) - before.get(pk, 0)
+            for pk in wanted.keys() | before.keys()
+        }
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
-        self.add_tags_ingredients(ingredients, tags, recipe)
+        recipe.tags.set(tags)
+        self.set_ingredients(recipe, ingredients, existing=False)
+        change_counter(
+            User.objects.filter(pk=recipe.author_id), 'recipes_count', 1)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        self.add_tags_ingredients(ingredients, tags, instance)
-        return super().update(instance, validated_data)
+        with bulk_write():
+            instance.tags.set(tags)
+            deltas = self.set_ingredients(instance, ingredients)
+            ShoppingListItem.objects.add_amounts(
+                instance.cart.values_list('author_id', flat=True), deltas)
+            return super().update(instance, validated_data)
@@ -0,0 +1,91 @@
+import csv
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+
+PDF_CACHE_KEY = 'shopping-list-pdf:{}'
+PDF_CACHE_TIMEOUT = 60 * 60
+PDF_FONT = 'ShoppingList'
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+
+
+def format_line(name, unit, total):
+    return f'{name} - {total} {unit}'
+
+
+def iter_txt(rows):
+    for name, unit, total in rows:
+        yield format_line(name, unit, total) + ' \n'
+
+
+class Echo:
+    """File-like object that hands back what csv.writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_pdf(rows):
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(PDF_FONT, settings.SHOPPING_LIST_FONT))
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin, step = 50, 18
+    canvas.setFont(PDF_FONT, 16)
+    canvas.drawString(margin, height - margin, 'Список покупок')
+    canvas.setFont(PDF_FONT, 12)
+    y = height - margin - 2 * step
+    for row in rows:
+        if y < margin:
+            canvas.showPage()
+            canvas.setFont(PDF_FONT, 12)
+            y = height - margin
+        canvas.drawString(margin, y, format_line(*row))
+        y -= step
+    canvas.save()
+    return buffer.getvalue()
+
+
+def iter_pdf(rows):
+    """PDF bytes, rendered once per distinct cart content."""
+    rows = list(rows)
+    digest = hashlib.sha256(repr(rows).encode()).hexdigest()
+    key = PDF_CACHE_KEY.format(digest)
+    document = cache.get(key)
+    if document is None:
+        document = render_pdf(rows)
+        cache.set(key, document, PDF_CACHE_TIMEOUT)
+    yield document
+
+
+WRITERS = {
+    'txt': (iter_txt, 'text/plain; charset=utf-8'),
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'pdf': (iter_pdf, 'application/pdf'),
+}
+
+
+def shopping_list_response(rows, file_format):
+    """Streams (name, unit, total) rows as a txt, csv or pdf attachment."""
+    if file_format not in WRITERS:
+        file_format = 'txt'
+    writer, content_type = WRITERS[file_format]
+    response = StreamingHttpResponse(writer(rows), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="shoplist.{file_format}"')
+    return response
@@ -0,0 +1,84 @@
+import base64
+import io
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.dataset import EMAIL_DOMAIN, generate
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def get_client(user=None):
+    client = APIClient()
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def get_image():
+    """Small PNG as a data URI for recipe payloads."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (40, 120, 200)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+def shopping_lists_match_carts():
+    out = io.StringIO()
+    try:
+        call_command('rebuild_shopping_lists', '--check', stdout=out)
+    except CommandError:
+        return False
+    return True
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANT_WORKERS=0)
+class DatasetTestCase(TestCase):
+    """recipes.dataset data: every recipe has several ingredients and
+    tags, every user several favorites, cart rows and followed authors."""
+    dataset = {'users': 6, 'recipes': 30}
+
+    @classmethod
+    def setUpTestData(cls):
+        generate(**cls.dataset)
+        cls.users = list(User.objects.filter(
+            email__endswith=EMAIL_DOMAIN).order_by('pk'))
+        cls.user = cls.users[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = get_client(self.user)
+        self.anon = get_client()
+
+
+def run_concurrently(count, target):
+    """Runs target(number) in count threads started together and returns
+    the results in order. Each thread closes its own connection."""
+    barrier = threading.Barrier(count)
+
+    def run(number):
+        try:
+            barrier.wait()
+            return target(number)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(count) as pool:
+        return list(pool.map(run, range(count)))
@@ -0,0 +1,102 @@
+import io
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TransactionTestCase, override_settings
+
+from recipes.dataset import EMAIL_DOMAIN, generate
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import User
+
+from .base import (MEDIA_ROOT, DatasetTestCase, get_client, run_concurrently,
+                   shopping_lists_match_carts)
+
+
+class BulkListTest(DatasetTestCase):
+
+    def bulk(self, method, route, recipe_ids):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{route}/', {'recipes': recipe_ids},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row['status'] for row in response.data['results']}
+
+    def test_add_and_remove(self):
+        for model, route in ((Favorite, 'favorite'),
+                             (ShoppingCart, 'shopping_cart')):
+            with self.subTest(route=route):
+                listed = set(model.objects.filter(
+                    author=self.user).values_list('recipe_id', flat=True))
+                free = list(Recipe.objects.exclude(
+                    pk__in=listed).values_list('pk', flat=True)[:3])
+                before = dict(Recipe.objects.values_list(
+                    'pk', model.counter_field))
+                missing = Recipe.objects.order_by('-pk').first().pk + 1
+                ids = free + [min(listed), missing]
+                self.assertEqual(self.bulk('post', route, ids), {
+                    **dict.fromkeys(free, 'added'),
+                    min(listed): 'exists', missing: 'not_found'})
+                self.assertEqual(self.bulk('post', route, free), dict.fromkeys(
+                    free, 'exists'))
+                for pk in free:
+                    self.assertEqual(getattr(
+                        Recipe.objects.get(pk=pk), model.counter_field),
+                        before[pk] + 1)
+                self.assertTrue(shopping_lists_match_carts())
+                self.assertEqual(self.bulk('delete', route, ids), {
+                    **dict.fromkeys(free + [min(listed)], 'removed'),
+                    missing: 'not_found'})
+                self.assertEqual(
+                    self.bulk('delete', route, free),
+                    dict.fromkeys(free, 'not_in_list'))
+                self.assertEqual(
+                    getattr(Recipe.objects.get(pk=min(listed)),
+                            model.counter_field),
+                    before[min(listed)] - 1)
+                self.assertTrue(shopping_lists_match_carts())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'нужны параллельные записи')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANT_WORKERS=0)
+class ConcurrentBulkListTest(TransactionTestCase):
+    """Overlapping bulk requests count every row exactly once."""
+
+    def setUp(self):
+        generate(users=3, recipes=12)
+        self.user = User.objects.filter(
+            email__endswith=EMAIL_DOMAIN).order_by('pk').first()
+        ShoppingCart.objects.filter(author=self.user).delete()
+        Favorite.objects.filter(author=self.user).delete()
+        call_command('recount', stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+
+    def send(self, method, route):
+        def target(number):
+            return getattr(get_client(self.user), method)(
+                f'/api/recipes/{route}/', {'recipes': self.recipe_ids},
+                format='json').status_code
+        return target
+
+    def assert_counters(self, model):
+        for recipe in Recipe.objects.annotate(rows=Count(
+                'favorites' if model is Favorite else 'cart')):
+            self.assertEqual(
+                getattr(recipe, model.counter_field), recipe.rows)
+
+    def test_overlapping_requests(self):
+        for model, route in ((Favorite, 'favorite'),
+                             (ShoppingCart, 'shopping_cart')):
+            with self.subTest(route=route):
+                statuses = run_concurrently(4, self.send('post', route))
+                self.assertEqual(statuses, [200] * 4)
+                self.assert_counters(model)
+                self.assertTrue(shopping_lists_match_carts())
+                statuses = run_concurrently(4, self.send('delete', route))
+                self.assertEqual(statuses, [200] * 4)
+                self.assertFalse(model.objects.filter(
+                    author=self.user).exists())
+                self.assert_counters(model)
+                self.assertTrue(shopping_lists_match_carts())
@@ -0,0 +1,54 @@
+import base64
+import random
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from api.utils import BASE64_CHUNK_SIZE, Base64ImageField
+
+
+def encode_png(size):
+    buffer = BytesIO()
+    rng = random.Random(0)
+    noise = bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3))
+    Image.frombytes('RGB', size, noise).save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+
+    def decode(self, payload):
+        return Base64ImageField().to_internal_value(
+            'data:image/png;base64,' + payload)
+
+    def assert_invalid(self, payload):
+        with self.assertRaises(ValidationError) as context:
+            self.decode(payload)
+        self.assertEqual(
+            context.exception.detail[0].code, 'invalid_image')
+
+    def test_whitespace_is_ignored(self):
+        payload = encode_png((4, 4))
+        wrapped = '\n'.join(
+            payload[offset:offset + 76]
+            for offset in range(0, len(payload), 76))
+        self.assertEqual(self.decode(wrapped).size, self.decode(payload).size)
+
+    def test_characters_outside_the_alphabet(self):
+        # Four of them keep the rest aligned, so a lenient decoder would
+        # skip them and still produce a valid image.
+        payload = encode_png((4, 4))
+        for bad in ('!', '-', '_', '*'):
+            with self.subTest(character=bad):
+                self.assert_invalid(payload[:12] + bad * 4 + payload[12:])
+
+    def test_invalid_character_in_a_later_chunk(self):
+        payload = encode_png((200, 200))
+        self.assertGreater(len(payload), BASE64_CHUNK_SIZE)
+        position = BASE64_CHUNK_SIZE + 12
+        self.assert_invalid(payload[:position] + '####' + payload[position:])
+
+    def test_bad_padding(self):
+        self.assert_invalid(encode_png((4, 4))[:-1])
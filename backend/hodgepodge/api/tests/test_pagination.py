@@ -0,0 +1,45 @@
+from django.test import RequestFactory
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from api.pagination import CustomPagination
+from recipes.models import Recipe
+
+from .base import DatasetTestCase
+
+
+class LowEstimatePagination(CustomPagination):
+    """Planner estimate well below the real number of rows."""
+    estimate = 10
+
+    def estimate_count(self, queryset):
+        return self.estimate, True
+
+
+class EstimatedCountTest(DatasetTestCase):
+
+    def paginate(self, page, limit=6):
+        pagination = LowEstimatePagination()
+        request = Request(RequestFactory().get(
+            '/api/recipes/', {'page': page, 'limit': limit}))
+        rows = pagination.paginate_queryset(
+            Recipe.objects.order_by('pk'), request)
+        return rows, pagination.get_paginated_response(
+            [row.pk for row in rows]).data
+
+    def test_pages_beyond_the_estimate_are_served(self):
+        ids = list(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertGreater(len(ids), LowEstimatePagination.estimate)
+        pages = (len(ids) + 5) // 6
+        seen = []
+        for page in range(1, pages + 1):
+            with self.subTest(page=page):
+                rows, data = self.paginate(page)
+                self.assertTrue(data['count_estimated'])
+                self.assertEqual(data['count'], LowEstimatePagination.estimate)
+                self.assertEqual(len(rows), min(6, len(ids) - len(seen)))
+                self.assertEqual(data['next'] is None, page == pages)
+                seen += data['results']
+        self.assertEqual(seen, ids)
+        with self.assertRaises(NotFound):
+            self.paginate(pages + 1)
@@ -0,0 +1,173 @@
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet
+from recipes.dataset import EMAIL_DOMAIN, PASSWORD, generate
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Follow, User
+from users.views import UserViewSet
+
+from .base import MEDIA_ROOT, get_client, get_image
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANT_WORKERS=0, QUERY_INSPECTION='raise')
+class QueryBudgetTest(TransactionTestCase):
+    """Every budgeted action under QUERY_INSPECTION='raise' on data with
+    several ingredients per recipe, several favorites and carts per user
+    and several followed authors.
+
+    A TransactionTestCase, so on_commit callbacks run inside the request
+    as they do in production and their queries are counted too.
+    """
+    ingredients_per_recipe = 10
+
+    def setUp(self):
+        generate(users=6, recipes=30,
+                 ingredients_per_recipe=self.ingredients_per_recipe,
+                 favorites=5, cart=4, follows=4)
+        self.users = list(User.objects.filter(
+            email__endswith=EMAIL_DOMAIN).order_by('pk'))
+        self.user = self.users[0]
+        self.client = get_client(self.user)
+        self.anon = get_client()
+        self.ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True))
+        self.tags = list(Tag.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        self.image = get_image()
+        self.counts = {}
+
+    def request(self, action, client, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, (action, response))
+        self.counts.setdefault(action, []).append(len(context))
+        return response
+
+    def recipe_payload(self, ingredients):
+        return {
+            'name': 'проверка бюджета',
+            'text': 'текст',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': self.tags[:2],
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in ingredients],
+        }
+
+    def free_recipes(self, count):
+        return list(Recipe.objects.exclude(
+            favorites__author=self.user).exclude(
+            cart__author=self.user).order_by('pk').values_list(
+            'pk', flat=True)[:count])
+
+    def run_recipes(self, size):
+        user, anon = self.client, self.anon
+        recipe = Recipe.objects.order_by('pk').first().pk
+        slugs = '&'.join(
+            f'tags={slug}' for slug in Tag.objects.values_list(
+                'slug', flat=True))
+        for query in ('limit=6', 'page=3&limit=6', 'cursor=&limit=6',
+                      slugs, 'is_favorited=1', 'is_in_shopping_cart=1',
+                      f'author={self.user.pk}'):
+            self.request('list', anon, 'get', f'/api/recipes/?{query}')
+            self.request('list', user, 'get', f'/api/recipes/?{query}')
+        self.request('retrieve', anon, 'get', f'/api/recipes/{recipe}/')
+        self.request('retrieve', user, 'get', f'/api/recipes/{recipe}/')
+        created = self.request(
+            'create', user, 'post', '/api/recipes/',
+            self.recipe_payload(self.ingredients[:size])).data['id']
+        for other in self.users[1:]:
+            ShoppingCart.objects.create(author=other, recipe_id=created)
+            Favorite.objects.create(author=other, recipe_id=created)
+        self.request(
+            'update', user, 'put', f'/api/recipes/{created}/',
+            self.recipe_payload(self.ingredients[size // 2:size // 2 + size]))
+        self.request(
+            'partial_update', user, 'patch', f'/api/recipes/{created}/',
+            self.recipe_payload(self.ingredients[:size]))
+        self.request('destroy', user, 'delete', f'/api/recipes/{created}/')
+        free = self.free_recipes(size)
+        for action in ('favorite', 'shopping_cart'):
+            path = f'/api/recipes/{free[0]}/{action}/'
+            self.request(action, user, 'post', path)
+            self.request(action, user, 'delete', path)
+            bulk = {'recipes': free}
+            path = f'/api/recipes/{action}/'
+            self.request(f'{action}_bulk', user, 'post', path, bulk)
+            if action == 'shopping_cart':
+                for format in ('txt', 'csv', 'pdf'):
+                    self.request(
+                        'download_shopping_cart', user, 'get',
+                        f'/api/recipes/download_shopping_cart/'
+                        f'?format={format}')
+            self.request(f'{action}_bulk', user, 'delete', path, bulk)
+
+    def run_catalog(self):
+        tag, ingredient = self.tags[0], self.ingredients[0]
+        self.request('tags:list', self.anon, 'get', '/api/tags/')
+        self.request('tags:retrieve', self.anon, 'get', f'/api/tags/{tag}/')
+        self.request(
+            'ingredients:list', self.anon, 'get', '/api/ingredients/')
+        self.request(
+            'ingredients:list', self.anon, 'get',
+            '/api/ingredients/?name=ингр')
+        self.request(
+            'ingredients:retrieve', self.anon, 'get',
+            f'/api/ingredients/{ingredient}/')
+
+    def run_users(self):
+        user, anon = self.client, self.anon
+        author = User.objects.exclude(followed__user=self.user).exclude(
+            pk=self.user.pk).order_by('pk').first()
+        self.request('users:list', user, 'get', '/api/users/?limit=6')
+        self.request('users:list', anon, 'get', '/api/users/?limit=6')
+        self.request(
+            'users:retrieve', user, 'get', f'/api/users/{author.pk}/')
+        self.request(
+            'users:retrieve', anon, 'get', f'/api/users/{author.pk}/')
+        self.request('users:create', anon, 'post', '/api/users/', {
+            'email': f'new{EMAIL_DOMAIN}', 'username': 'new',
+            'first_name': 'Имя', 'last_name': 'Фамилия',
+            'password': PASSWORD,
+        })
+        self.request('users:me', user, 'get', '/api/users/me/')
+        self.request(
+            'users:set_password', user, 'post', '/api/users/set_password/',
+            {'current_password': PASSWORD, 'new_password': PASSWORD})
+        path = f'/api/users/{author.pk}/subscribe/'
+        self.request('users:subscribe', user, 'post', path)
+        self.assertGreater(Follow.objects.filter(user=self.user).count(), 1)
+        self.request(
+            'users:subscriptions', user, 'get',
+            '/api/users/subscriptions/?recipes_limit=3')
+        self.request('users:subscribe', user, 'delete', path)
+
+    def test_budgets(self):
+        self.run_catalog()
+        self.run_recipes(self.ingredients_per_recipe)
+        self.run_users()
+        expected = {
+            *(f'tags:{action}' for action in TagViewSet.query_budgets),
+            *(f'ingredients:{action}'
+              for action in IngredientViewSet.query_budgets),
+            *RecipeViewSet.query_budgets,
+            *(f'users:{action}' for action in UserViewSet.query_budgets),
+        }
+        self.assertEqual(set(self.counts), expected)
+
+    def test_recipe_writes_do_not_grow_with_ingredients(self):
+        # The first round creates the version stamps and fills the
+        # caches; the next two differ only in the number of ingredients
+        # and recipes written.
+        self.run_recipes(2)
+        self.counts = {}
+        self.run_recipes(2)
+        few = self.counts
+        self.counts = {}
+        self.run_recipes(self.ingredients_per_recipe)
+        self.assertEqual(self.counts, few)
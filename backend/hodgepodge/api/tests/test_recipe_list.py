@@ -0,0 +1,36 @@
+from django.core.cache import cache
+from django.db import connection
+
+from .base import DatasetTestCase
+
+
+class RecipeListQueriesTest(DatasetTestCase):
+    """The recipe list costs the same number of queries for any page size.
+
+    Anonymous: the recipes version stamp for the ETag and again for the
+    count cache key, the count, the page and one prefetch each for tags
+    and ingredients. Authenticated: the token and the
+    user's own version stamp on top of that. PostgreSQL asks the planner
+    for a row estimate before counting.
+    """
+
+    def assert_queries(self, client, expected):
+        expected += connection.vendor == 'postgresql'
+        # Creates the version stamps, which happens once per database.
+        client.get('/api/recipes/?limit=1')
+        for limit in (3, 12):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+                for recipe in response.data['results']:
+                    self.assertGreater(len(recipe['ingredients']), 1)
+                    self.assertTrue(recipe['tags'])
+
+    def test_anonymous(self):
+        self.assert_queries(self.anon, 6)
+
+    def test_authenticated(self):
+        self.assert_queries(self.client, 8)
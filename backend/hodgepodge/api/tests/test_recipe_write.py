@@ -0,0 +1,28 @@
+from recipes.models import Ingredient, Recipe, Tag
+
+from .base import DatasetTestCase, get_image
+
+
+class RecipeWriteValidationTest(DatasetTestCase):
+
+    def test_unknown_ingredient_is_reported_per_item(self):
+        known = Ingredient.objects.order_by('pk').first().pk
+        missing = Ingredient.objects.order_by('-pk').first().pk + 1
+        before = Recipe.objects.count()
+        response = self.client.post('/api/recipes/', {
+            'name': 'неизвестный ингредиент',
+            'text': 'текст',
+            'cooking_time': 10,
+            'image': get_image(),
+            'tags': [Tag.objects.order_by('pk').first().pk],
+            'ingredients': [{'id': known, 'amount': 10},
+                            {'id': missing, 'amount': 10}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'ingredients': [
+            {},
+            {'id': [f'Invalid pk "{missing}" - object does not exist.']},
+        ]})
+        self.assertEqual(
+            response.data['ingredients'][1]['id'][0].code, 'does_not_exist')
+        self.assertEqual(Recipe.objects.count(), before)
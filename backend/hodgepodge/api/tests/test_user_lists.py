@@ -0,0 +1,115 @@
+import io
+from collections import Counter
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from recipes.dataset import EMAIL_DOMAIN, generate
+from recipes.models import (Favorite, IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem)
+from users.models import User
+
+from .base import (MEDIA_ROOT, DatasetTestCase, get_client,
+                   run_concurrently, shopping_lists_match_carts)
+
+THREADS = 8
+
+
+class ShoppingListDownloadTest(DatasetTestCase):
+    """The download costs the token and one read of the stored shopping
+    list, however many recipes the cart holds. The read touches neither
+    the cart nor the recipe ingredients, and returns one row per item.
+    So the work grows with the number of distinct ingredients and not
+    with the size of the cart."""
+
+    def fill_cart(self, count):
+        ShoppingCart.objects.filter(author=self.user).delete()
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True)[:count])
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'recipes': recipe_ids},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        return ShoppingListItem.objects.filter(
+            user=self.user, total_amount__gt=0).count()
+
+    def download(self, file_format):
+        """(content, SQL of the shopping list read)."""
+        with self.assertNumQueries(2) as context:
+            response = self.client.get(
+                f'/api/recipes/download_shopping_cart/?format={file_format}')
+            self.assertEqual(response.status_code, 200)
+            return (b''.join(response.streaming_content),
+                    context.captured_queries[-1]['sql'])
+
+    def assert_reads_shopping_list(self, sql):
+        self.assertIn(ShoppingListItem._meta.db_table, sql)
+        for model in (ShoppingCart, IngredientAmount):
+            self.assertNotIn(model._meta.db_table, sql)
+
+    def test_queries_do_not_grow_with_the_cart(self):
+        few = self.fill_cart(1)
+        many = self.fill_cart(Recipe.objects.count())
+        self.assertGreater(many, few)
+        for count, items in ((1, few), (Recipe.objects.count(), many)):
+            self.fill_cart(count)
+            with self.subTest(recipes=count):
+                txt, sql = self.download('txt')
+                self.assertEqual(len(txt.splitlines()), items)
+                self.assert_reads_shopping_list(sql)
+                csv, _ = self.download('csv')
+                self.assertEqual(len(csv.splitlines()), items + 1)
+                pdf, _ = self.download('pdf')
+                self.assertTrue(pdf.startswith(b'%PDF'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'нужны параллельные записи')
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANT_WORKERS=0)
+class ConcurrentUserListTest(TransactionTestCase):
+    """The same user adds the same recipe from many requests at once."""
+
+    def setUp(self):
+        generate(users=3, recipes=6)
+        self.user = User.objects.filter(
+            email__endswith=EMAIL_DOMAIN).order_by('pk').first()
+        self.recipe = Recipe.objects.order_by('pk').first()
+        Favorite.objects.filter(recipe=self.recipe).delete()
+        ShoppingCart.objects.filter(recipe=self.recipe).delete()
+        call_command('recount', stdout=io.StringIO())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+
+    def post(self, route):
+        def target(number):
+            client = get_client(self.user)
+            client.raise_request_exception = False
+            return client.post(
+                f'/api/recipes/{self.recipe.pk}/{route}/').status_code
+        return Counter(run_concurrently(THREADS, target))
+
+    def test_favorite(self):
+        self.assertEqual(
+            self.post('favorite'), {201: 1, 400: THREADS - 1})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(Favorite.objects.filter(
+            author=self.user, recipe=self.recipe).count(), 1)
+
+    def test_shopping_cart(self):
+        items = dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'total_amount'))
+        self.assertEqual(
+            self.post('shopping_cart'), {201: 1, 400: THREADS - 1})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.cart_count, 1)
+        self.assertEqual(ShoppingCart.objects.filter(
+            author=self.user, recipe=self.recipe).count(), 1)
+        for ingredient_id, amount in IngredientAmount.objects.filter(
+                recipe=self.recipe).values_list('ingredient_id', 'amount'):
+            self.assertEqual(
+                ShoppingListItem.objects.get(
+                    user=self.user, ingredient_id=ingredient_id,
+                ).total_amount,
+                items.get(ingredient_id, 0) + amount)
+        self.assertTrue(shopping_lists_match_carts())
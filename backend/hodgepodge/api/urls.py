@@ -3,15 +3,16 @@ from rest_framework.routers import DefaultRouter
 
 from users.views import UserViewSet
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet, metrics
 
 router = DefaultRouter()
-router.register('users', UserViewSet)
-router.register('recipes', RecipeViewSet)
-router.register('tags', TagViewSet)
-router.register('ingredients', IngredientViewSet)
+router.register('users', UserViewSet, basename='users')
+router.register('recipes', RecipeViewSet, basename='recipes')
+router.register('tags', TagViewSet, basename='tags')
+router.register('ingredients', IngredientViewSet, basename='ingredients')
 
 urlpatterns = [
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
     re_path(r'auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,35 +1,55 @@
 import base64
+import binascii
+import hashlib
 import uuid
+from io import BytesIO
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
-from recipes.models import Recipe
+from recipes.cache import bump_version, user_version_name
+from recipes.counters import change_counter
+from recipes.models import (IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem)
+from recipes.signals import bulk_write
 
 
 def post(request, pk, model, serializer):
+    """Adds the recipe to the user's list.
+
+    The unique constraint decides whether the row is new, so concurrent
+    requests for the same pair get a 400 instead of a 500.
+    """
     recipe = get_object_or_404(Recipe, id=pk)
-    if model.objects.filter(author=request.user, recipe=recipe).exists():
-        return Response(
-            {'errors': 'Recipe has already been added'},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
-    instance = model(recipe=recipe, author=request.user)
-    instance.save()
-    serializer = serializer(
-        get_object_or_404(Recipe, id=pk), context={"request": request}
-    )
+    with transaction.atomic(), bulk_write():
+        try:
+            with transaction.atomic():
+                model.objects.create(recipe=recipe, author=request.user)
+        except IntegrityError:
+            return Response(
+                {'errors': 'Recipe has already been added'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        list_changed(request.user, model, [recipe.pk], 1)
+    serializer = serializer(recipe, context={"request": request})
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 def delete(request, pk, model):
+    """Removes the recipe from the user's list, relying on the number of
+    deleted rows rather than a separate existence check."""
     recipe = get_object_or_404(Recipe, id=pk)
-    if model.objects.filter(author=request.user, recipe=recipe).exists():
-        follow = get_object_or_404(model, author=request.user,
-                                   recipe=recipe)
-        follow.delete()
+    with transaction.atomic(), bulk_write():
+        deleted, _ = model.objects.filter(
+            author=request.user, recipe=recipe).delete()
+        if deleted:
+            list_changed(request.user, model, [recipe.pk], -1)
+    if deleted:
         return Response(
             'Recipe has been deleted',
             status=status.HTTP_204_NO_CONTENT
@@ -40,13 +60,167 @@ def delete(request, pk, model):
     )
 
 
+def bulk_post(request, recipe_ids, model):
+    """Adds the recipes to the user's list in one INSERT.
+
+    Returns per-id outcomes: added, exists or not_found.
+    """
+    found = set(Recipe.objects.filter(
+        pk__in=recipe_ids).values_list('pk', flat=True))
+    with transaction.atomic(), bulk_write():
+        added = model.objects.add_recipes(request.user, found)
+        list_changed(request.user, model, added, 1)
+    return bulk_response(recipe_ids, found, added, 'added', 'exists')
+
+
+def bulk_delete(request, recipe_ids, model):
+    """Removes the recipes from the user's list in one DELETE.
+
+    Returns per-id outcomes: removed, not_in_list or not_found.
+    """
+    found = set(Recipe.objects.filter(
+        pk__in=recipe_ids).values_list('pk', flat=True))
+    with transaction.atomic(), bulk_write():
+        removed = model.objects.remove_recipes(request.user, found)
+        list_changed(request.user, model, removed, -1)
+    return bulk_response(
+        recipe_ids, found, removed, 'removed', 'not_in_list')
+
+
+def bulk_response(recipe_ids, found, changed, changed_status, kept_status):
+    results = []
+    for pk in recipe_ids:
+        if pk not in found:
+            outcome = 'not_found'
+        elif pk in changed:
+            outcome = changed_status
+        else:
+            outcome = kept_status
+        results.append({'id': pk, 'status': outcome})
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+def list_changed(user, model, recipe_ids, sign):
+    """Counters, shopping list and version stamp after a write.
+
+    Call inside bulk_write() so the row-level receivers leave the
+    shopping list alone.
+    """
+    if not recipe_ids:
+        return
+    change_counter(
+        Recipe.objects.filter(pk__in=recipe_ids), model.counter_field, sign)
+    update_shopping_list(model, user, recipe_ids, sign)
+    bump_version(user_version_name(user.pk))
+
+
+def update_shopping_list(model, user, recipe_ids, sign):
+    """Adds (sign=1) or removes (sign=-1) the recipes' ingredients from
+    the user's shopping list when the cart changes."""
+    if model is not ShoppingCart:
+        return
+    amounts = IngredientAmount.objects.filter(
+        recipe_id__in=recipe_ids).amounts()
+    ShoppingListItem.objects.add_amounts([user.pk], {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in amounts.items()
+    })
+
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+    (b'RIFF', 'webp', 'image/webp'),
+)
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def detect_image_type(head):
+    """(extension, content type) from the magic bytes, or None."""
+    for signature, ext, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            if ext == 'webp' and head[8:12] != b'WEBP':
+                return None
+            return ext, content_type
+    return None
+
+
 class Base64ImageField(serializers.ImageField):
+    """Image given as a data:image/...;base64, URI.
+
+    The payload is decoded in chunks into an upload file that stays in
+    memory up to FILE_UPLOAD_MAX_MEMORY_SIZE and spills to a temporary
+    file above it, just like multipart uploads. The magic bytes are
+    checked on the first chunk and IMAGE_UPLOAD_MAX_SIZE while decoding.
+    """
+    default_error_messages = {
+        'too_large': 'Image is larger than {max_size} bytes.',
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            formating, imgstr = data.split(';base64,')
-            ext = formating.split('/')[-1]
-            id = uuid.uuid4()
-            data = ContentFile(
-                base64.b64decode(imgstr),
-                name=id.urn[9:] + '.' + ext)
+            data = self.decode(data)
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        start = data.find(';base64,')
+        if start < 0:
+            self.fail('invalid_image')
+        start += len(';base64,')
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if (len(data) - start) // 4 * 3 > max_size + 3:
+            self.fail('too_large', max_size=max_size)
+        upload = None
+        digest = hashlib.sha256()
+        try:
+            for decoded in self.iter_decoded(data, start):
+                if upload is None:
+                    upload = self.open_upload(decoded, len(data) - start)
+                if upload.size + len(decoded) > max_size:
+                    self.fail('too_large', max_size=max_size)
+                upload.write(decoded)
+                upload.size += len(decoded)
+                digest.update(decoded)
+        except serializers.ValidationError:
+            if upload is not None:
+                upload.close()
+            raise
+        if upload is None:
+            self.fail('invalid_image')
+        upload.sha256 = digest.hexdigest()
+        upload.seek(0)
+        return upload
+
+    def iter_decoded(self, data, start):
+        """Decoded bytes of data[start:], BASE64_CHUNK_SIZE at a time.
+
+        Whitespace is dropped; any other character outside the base64
+        alphabet fails with invalid_image.
+        """
+        rest = ''
+        for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[offset:offset + BASE64_CHUNK_SIZE].split())
+            end = len(chunk)
+            if offset + BASE64_CHUNK_SIZE < len(data):
+                end -= end % 4
+            chunk, rest = chunk[:end], chunk[end:]
+            try:
+                decoded = base64.b64decode(chunk, validate=True)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
+            if decoded:
+                yield decoded
+
+    def open_upload(self, head, encoded_size):
+        image_type = detect_image_type(head)
+        if image_type is None:
+            self.fail('invalid_image')
+        ext, content_type = image_type
+        name = f'{uuid.uuid4()}.{ext}'
+        if encoded_size // 4 * 3 > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            return TemporaryUploadedFile(name, content_type, 0, None)
+        return InMemoryUploadedFile(
+            BytesIO(), self.field_name, name, content_type, 0, None)
@@ -1,30 +1,45 @@
+from django.db import transaction
 from django.http import HttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import (action, api_view,
+                                       permission_classes)
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 
 from api.filters import IngredientFilter, RecipeFilter
+from api.mixins import ConditionalGetMixin, get_requested_fields
 from api.pagination import CustomPagination
-from api.permissions import IsOwnerOrAdminOrReadOnly
-from api.serializers import (IngredientSerializer, RecipeListSerializer,
-                             RecipeSmallSerializer, RecipeWriteSerializer,
-                             TagSerializer)
-from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
-                            ShoppingCart, Tag)
+from api.permissions import IsAdmin, IsOwnerOrAdminOrReadOnly
+from api.renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from api.serializers import (IngredientSerializer, RecipeIdsSerializer,
+                             RecipeListSerializer, RecipeSmallSerializer,
+                             RecipeWriteSerializer, TagSerializer)
+from recipes.counters import change_counter
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from recipes.signals import bulk_write
+from users.models import User
 
-from .utils import delete, post
+from .metrics import CONTENT_TYPE, render as render_metrics
+from .shopping_list import shopping_list_response
+from .utils import bulk_delete, bulk_post, delete, post
 
 
-class TagViewSet(mixins.ListModelMixin,
+class TagViewSet(ConditionalGetMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny, )
+    version_name = Tag._meta.label_lower
+    personal_state = False
+    query_budgets = {'list': 2, 'retrieve': 2}
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(ConditionalGetMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     queryset = Ingredient.objects.all()
@@ -32,14 +47,66 @@ class IngredientViewSet(mixins.ListModelMixin,
     pagination_class = None
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    version_name = Ingredient._meta.label_lower
+    personal_state = False
+    query_budgets = {'list': 4, 'retrieve': 2}
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsOwnerOrAdminOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     pagination_class = CustomPagination
+    cursor_ordering = ('-created', '-id')
+    deferrable_fields = (('text', 'text'), ('images', 'image_variants'))
+    personal_filters = ('is_favorited', 'is_in_shopping_cart')
     filterset_class = RecipeFilter
+    version_name = Recipe._meta.label_lower
+    query_budgets = {
+        'list': 10,
+        'retrieve': 6,
+        'create': 19,
+        'update': 22,
+        'partial_update': 22,
+        'destroy': 19,
+        'favorite': 9,
+        'shopping_cart': 13,
+        'favorite_bulk': 9,
+        'shopping_cart_bulk': 12,
+        'download_shopping_cart': 3,
+    }
+
+    def get_detail_validator(self):
+        try:
+            return Recipe.objects.filter(pk=self.kwargs['pk']).values_list(
+                'updated', flat=True).first()
+        except ValueError:
+            return None
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            fields = get_requested_fields(
+                self.request, RecipeListSerializer.Meta.fields)
+            deferred = [
+                column for name, column in self.deferrable_fields
+                if name not in fields
+            ]
+            queryset = Recipe.objects.for_representation(
+                self.request.user).defer(*deferred)
+            if 'author' not in fields:
+                return queryset.select_related(None)
+            return queryset
+        return Recipe.objects.with_user_flags(self.request.user)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.add_amounts(
+            instance.cart.values_list('author_id', flat=True),
+            {pk: -amount for pk, amount in instance.amount.amounts().items()})
+        with bulk_write():
+            super().perform_destroy(instance)
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', -1)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -58,33 +125,46 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return post(request, pk, ShoppingCart, RecipeSmallSerializer)
         return delete(request, pk, ShoppingCart)
 
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='favorite', url_name='favorite-bulk',
+            permission_classes=[IsAuthenticated])
+    def favorite_bulk(self, request):
+        """Adds or removes {"recipes": [id, ...]} in one request."""
+        return self.bulk(request, Favorite)
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='shopping_cart', url_name='shopping-cart-bulk',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        """Adds or removes {"recipes": [id, ...]} in one request."""
+        return self.bulk(request, ShoppingCart)
+
+    def bulk(self, request, model):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return bulk_post(request, recipe_ids, model)
+        return bulk_delete(request, recipe_ids, model)
+
     @action(detail=False,
             methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[PlainTextRenderer, CSVRenderer, PDFRenderer,
+                              JSONRenderer])
     def download_shopping_cart(self, request):
-        user = self.request.user
-        shopping_cart = user.cart.all()
-        catlg = {}
-        for item in shopping_cart:
-            recipe = item.recipe
-            ingredients = IngredientAmount.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                amount = ingredient.amount
-                name = ingredient.ingredient.name
-                measurement_unit = ingredient.ingredient.measurement_unit
-                if name not in catlg:
-                    catlg[name] = {
-                        'measurement_unit': measurement_unit,
-                        'amount': amount
-                    }
-                else:
-                    catlg[name]['amount'] = (
-                        catlg[name]['amount'] + amount
-                    )
-        shopping_list = [
-            f'{item} - {value["amount"]} {catlg[item]["measurement_unit"]} \n'
-            for item, value in catlg.items()
-        ]
-        response = HttpResponse(shopping_list, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="shoplist.txt"'
-        return response
+        """Shopping list as ?format=txt (default), csv or pdf."""
+        rows = request.user.shopping_list.order_by(
+            'ingredient__name', 'ingredient__measurement_unit',
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount',
+        ).iterator(chunk_size=500)
+        return shopping_list_response(rows, request.accepted_renderer.format)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def metrics(request):
+    """Per-route request metrics of this worker for Prometheus."""
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -39,16 +39,13 @@ class IngredientAmountInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author')
+    list_display = ('id', 'name', 'author', 'favorites_count', 'cart_count')
     search_fields = ('author',)
     list_filter = ('author', 'name', 'tags', 'ingredients', 'cooking_time')
     ordering = ('name',)
     empty_value_display = '-пусто-'
     inlines = (IngredientAmountInline, )
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
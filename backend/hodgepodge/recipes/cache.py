@@ -0,0 +1,45 @@
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import CollectionVersion
+
+
+def get_version(name):
+    """Returns the current version stamp of a collection."""
+    stamp = CollectionVersion.objects.filter(name=name).values_list(
+        'stamp', flat=True).first()
+    if stamp is not None:
+        return stamp
+    try:
+        with transaction.atomic():
+            return CollectionVersion.objects.create(
+                name=name, stamp=time.time_ns()).stamp
+    except IntegrityError:
+        return CollectionVersion.objects.get(name=name).stamp
+
+
+def bump_version(*names):
+    """Gives every named collection a new version stamp once the current
+    transaction commits.
+
+    Stamps only grow, and the update runs outside the writer's
+    transaction, so concurrent writers never wait on the version rows.
+    """
+    transaction.on_commit(lambda: write_versions(names))
+
+
+def write_versions(names):
+    stamp = time.time_ns()
+    updated = CollectionVersion.objects.filter(name__in=names).update(
+        stamp=Greatest(F('stamp') + 1, Value(stamp)))
+    if updated < len(set(names)):
+        CollectionVersion.objects.bulk_create(
+            (CollectionVersion(name=name, stamp=stamp) for name in names),
+            ignore_conflicts=True)
+
+
+def user_version_name(user_id):
+    return f'user:{user_id}'
@@ -0,0 +1,25 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def change_counter(queryset, field, delta):
+    """Atomically adds delta to a denormalized counter column."""
+    return queryset.update(**{field: F(field) + delta})
+
+
+def recount(queryset, field, related, related_field):
+    """Rebuilds a counter from the related rows in one UPDATE.
+
+    Only rows that drifted are written; their number is returned.
+    """
+    actual = Coalesce(
+        Subquery(
+            related.filter(**{related_field: OuterRef('pk')})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+    return queryset.exclude(**{field: actual}).update(**{field: actual})
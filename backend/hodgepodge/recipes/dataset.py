@@ -0,0 +1,176 @@
+"""Deterministic synthetic data for local load testing.
+
+Everything is written with bulk_create; the same seed and sizes always
+produce the same rows.
+"""
+import random
+from io import BytesIO, StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from PIL import Image
+
+from users.models import Follow, User
+
+from .cache import bump_version
+from .models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                     ShoppingCart, Tag)
+
+PASSWORD = 'benchmark-password'
+USERNAME = 'bench_{}'
+EMAIL_DOMAIN = '@bench.example.com'
+TAGS = (
+    ('Завтрак', '#c90076', 'breakfast'),
+    ('Обед', '#49B64E', 'dinner'),
+    ('Ужин', '#7c12e1', 'supper'),
+)
+WORDS = (
+    'суп', 'салат', 'пирог', 'рагу', 'каша', 'омлет', 'паста', 'плов',
+    'быстрый', 'домашний', 'летний', 'острый', 'сырный', 'овощной',
+)
+
+
+def generate(users=100, recipes=1000, ingredients_per_recipe=8,
+             favorites=10, cart=3, follows=5, seed=0, batch_size=1000):
+    """Creates the dataset and returns the number of rows per model."""
+    rng = random.Random(seed)
+    with transaction.atomic():
+        tags = ensure_tags()
+        ingredients = ensure_ingredients(ingredients_per_recipe * 4)
+        user_ids = create_users(users, batch_size)
+        recipe_ids = create_recipes(
+            rng, user_ids, recipes, tags, ingredients,
+            ingredients_per_recipe, batch_size)
+        create_pairs(Favorite, 'author', 'recipe', rng, user_ids,
+                     recipe_ids, favorites, batch_size)
+        create_pairs(ShoppingCart, 'author', 'recipe', rng, user_ids,
+                     recipe_ids, cart, batch_size)
+        create_pairs(Follow, 'user', 'author', rng, user_ids,
+                     user_ids, follows, batch_size)
+        call_command('recount', stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+    bump_version(*(
+        model._meta.label_lower
+        for model in (Recipe, Tag, Ingredient, Follow, User)
+    ))
+    return {
+        model.__name__: model.objects.count()
+        for model in (User, Recipe, IngredientAmount, Favorite,
+                      ShoppingCart, Follow)
+    }
+
+
+def ensure_tags():
+    Tag.objects.bulk_create(
+        (Tag(name=name, color=color, slug=slug)
+         for name, color, slug in TAGS),
+        ignore_conflicts=True)
+    return list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+
+
+def ensure_ingredients(minimum):
+    missing = minimum - Ingredient.objects.count()
+    if missing > 0:
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+             for number in range(missing)),
+            ignore_conflicts=True)
+    return list(Ingredient.objects.order_by('pk').values_list(
+        'pk', flat=True))
+
+
+def create_users(count, batch_size):
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        (
+            User(
+                username=USERNAME.format(number),
+                email=f'{USERNAME.format(number)}{EMAIL_DOMAIN}',
+                first_name='Имя',
+                last_name=f'Фамилия {number}',
+                password=password,
+            )
+            for number in range(count)
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return list(User.objects.filter(
+        email__endswith=EMAIL_DOMAIN,
+    ).order_by('pk').values_list('pk', flat=True)[:count])
+
+
+def get_image():
+    """One small PNG shared by every generated recipe."""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    field = Recipe._meta.get_field('image')
+    return field.storage.save(
+        field.generate_filename(None, 'bench.png'),
+        ContentFile(buffer.getvalue()))
+
+
+def create_recipes(rng, user_ids, count, tags, ingredients,
+                   ingredients_per_recipe, batch_size):
+    image = get_image()
+    names = [
+        (rng.choice(user_ids), f'{rng.choice(WORDS)} {number}')
+        for number in range(count)
+    ]
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author_id=author_id,
+                name=name,
+                text=' '.join(rng.choices(WORDS, k=40)),
+                cooking_time=rng.randint(5, 180),
+                image=image,
+            )
+            for author_id, name in names
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    recipe_ids = list(Recipe.objects.filter(
+        author__email__endswith=EMAIL_DOMAIN,
+    ).order_by('pk').values_list('pk', flat=True))
+    IngredientAmount.objects.bulk_create(
+        (
+            IngredientAmount(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(
+                ingredients, min(ingredients_per_recipe, len(ingredients)))
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    Recipe.tags.through.objects.bulk_create(
+        (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tags, rng.randint(1, len(tags)))
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return recipe_ids
+
+
+def create_pairs(model, owner, target, rng, owner_ids, target_ids,
+                 per_owner, batch_size):
+    """per_owner random (owner, target) rows for every owner."""
+    model.objects.bulk_create(
+        (
+            model(**{f'{owner}_id': owner_id, f'{target}_id': target_id})
+            for owner_id in owner_ids
+            for target_id in rng.sample(
+                target_ids, min(per_owner, len(target_ids)))
+            if target_id != owner_id or model is not Follow
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
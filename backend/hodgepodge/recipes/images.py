@@ -0,0 +1,127 @@
+"""Resized and WebP variants of recipe images.
+
+Variants are rendered in a process pool after the recipe is committed
+and recorded in Recipe.image_variants as
+{'source': <image name>, <size>: {'default': <name>, 'webp': <name>}}.
+Until the source matches the current image, the original is served.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image
+
+from .cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'small': 320,
+    'medium': 640,
+}
+VARIANT_DIR = 'variants'
+WEBP_QUALITY = 80
+
+
+def variant_name(name, size, ext):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANT_DIR, f'{stem}-{size}.{ext}')
+
+
+def save_image(image, name, image_format, overwrite=False, **options):
+    """Variant names follow the source name, so an existing file already
+    holds this variant unless overwrite is asked for."""
+    if default_storage.exists(name):
+        if not overwrite:
+            return name
+        default_storage.delete(name)
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def render_variants(name, overwrite=False):
+    """Writes every size of the image in its own format and in WebP.
+
+    Runs in the worker processes, so it only touches storage.
+    """
+    with default_storage.open(name) as source:
+        original = Image.open(source)
+        original.load()
+    image_format = original.format or 'PNG'
+    if image_format == 'GIF':
+        image_format = 'PNG'
+    ext = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    variants = {'source': name}
+    for size, side in VARIANT_SIZES.items():
+        image = original.copy()
+        image.thumbnail((side, side))
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        variants[size] = {
+            'default': save_image(
+                image, variant_name(name, size, ext), image_format,
+                overwrite),
+            'webp': save_image(
+                image, variant_name(name, size, 'webp'), 'WEBP',
+                overwrite, quality=WEBP_QUALITY),
+        }
+    return variants
+
+
+def store_variants(recipe_id, name, variants):
+    """Records variants unless the recipe got another image meanwhile."""
+    from .models import Recipe
+
+    if Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants, updated=timezone.now()):
+        bump_version(Recipe._meta.label_lower)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ProcessPoolExecutor(
+        max_workers=settings.IMAGE_VARIANT_WORKERS,
+        initializer=django.setup)
+
+
+def variants_done(recipe_id, name, future):
+    """Done callback, runs in a thread of the web process."""
+    try:
+        store_variants(recipe_id, name, future.result())
+    except Exception:
+        logger.exception('Image variants of %s failed', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe_id, name):
+    """Renders the variants off the request, or inline when
+    IMAGE_VARIANT_WORKERS is 0."""
+    if not settings.IMAGE_VARIANT_WORKERS:
+        try:
+            store_variants(recipe_id, name, render_variants(name))
+        except Exception:
+            logger.exception('Image variants of %s failed', name)
+        return
+    future = get_executor().submit(render_variants, name)
+    future.add_done_callback(partial(variants_done, recipe_id, name))
+
+
+def get_variant(recipe, size, kind='default'):
+    """Storage name of a variant, falling back to the original."""
+    variants = recipe.image_variants or {}
+    if variants.get('source') != recipe.image.name:
+        return recipe.image.name
+    return variants.get(size, {}).get(kind, recipe.image.name)
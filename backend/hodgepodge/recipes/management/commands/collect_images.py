@@ -0,0 +1,65 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Удаляем картинки рецептов, на которые больше нет ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено')
+        parser.add_argument(
+            '--min-age', type=int, default=24,
+            help='Не трогать файлы моложе стольких часов')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for image, variants in Recipe.objects.values_list(
+                'image', 'image_variants').iterator():
+            referenced.add(image)
+            for size in variants.values():
+                if isinstance(size, dict):
+                    referenced.update(size.values())
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        upload_to = Recipe._meta.get_field('image').upload_to
+        removed = freed = 0
+        for name in self.walk(default_storage, upload_to.rstrip('/')):
+            if name in referenced:
+                continue
+            if default_storage.get_modified_time(name) > cutoff:
+                continue
+            if self.is_referenced(name):
+                continue
+            removed += 1
+            freed += default_storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+        verb = 'К удалению' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов: {removed}, байт: {freed}'))
+
+    @staticmethod
+    def is_referenced(name):
+        """Checks the database again right before deleting, for recipes
+        saved since the references were read."""
+        return Recipe.objects.filter(image=name).exists()
+
+    def walk(self, storage, directory):
+        """Yields file names one directory listing at a time."""
+        if not storage.exists(directory):
+            return
+        directories, files = storage.listdir(directory)
+        for filename in files:
+            yield os.path.join(directory, filename)
+        for subdirectory in directories:
+            yield from self.walk(
+                storage, os.path.join(directory, subdirectory))
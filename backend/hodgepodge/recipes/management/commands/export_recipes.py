@@ -0,0 +1,76 @@
+import json
+import sys
+from collections import defaultdict
+from itertools import islice
+
+from django.core.management import BaseCommand
+
+from recipes.models import IngredientAmount, Recipe
+
+
+class Command(BaseCommand):
+    """Writes one JSON object per recipe:
+
+    {"name", "text", "cooking_time", "image", "author": <email>,
+     "created": <ISO 8601>,
+     "tags": [<slug>, ...],
+     "ingredients": [{"name", "measurement_unit", "amount"}, ...]}
+    """
+    help = 'Выгружаем рецепты в NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Рецептов в одной выборке')
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            self.export(sys.stdout, options['batch_size'])
+            return
+        with open(options['output'], 'w', encoding='UTF-8') as output:
+            total = self.export(output, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Выгружено рецептов: {total}'))
+
+    def export(self, output, batch_size):
+        recipes = Recipe.objects.order_by('pk').values(
+            'pk', 'name', 'text', 'cooking_time', 'image', 'author__email',
+            'created',
+        ).iterator(chunk_size=batch_size)
+        total = 0
+        while True:
+            batch = list(islice(recipes, batch_size))
+            if not batch:
+                return total
+            tags, ingredients = self.get_related([row['pk'] for row in batch])
+            for row in batch:
+                output.write(json.dumps({
+                    'name': row['name'],
+                    'text': row['text'],
+                    'cooking_time': row['cooking_time'],
+                    'image': row['image'],
+                    'author': row['author__email'],
+                    'created': row['created'].isoformat(),
+                    'tags': tags[row['pk']],
+                    'ingredients': ingredients[row['pk']],
+                }, ensure_ascii=False) + '\n')
+            total += len(batch)
+
+    @staticmethod
+    def get_related(recipe_ids):
+        """Tag slugs and ingredient rows of the batch in two queries."""
+        tags = defaultdict(list)
+        for recipe_id, slug in Recipe.tags.through.objects.filter(
+                recipe_id__in=recipe_ids).order_by('pk').values_list(
+                'recipe_id', 'tag__slug'):
+            tags[recipe_id].append(slug)
+        ingredients = defaultdict(list)
+        for recipe_id, name, unit, amount in IngredientAmount.objects.filter(
+                recipe_id__in=recipe_ids).order_by('pk').values_list(
+                'recipe_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'):
+            ingredients[recipe_id].append(
+                {'name': name, 'measurement_unit': unit, 'amount': amount})
+        return tags, ingredients
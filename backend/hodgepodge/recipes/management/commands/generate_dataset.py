@@ -0,0 +1,39 @@
+from django.core.management import BaseCommand
+
+from recipes.dataset import generate
+
+
+class Command(BaseCommand):
+    help = 'Создаем тестовый набор данных для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument(
+            '--favorites', type=int, default=10,
+            help='Избранных рецептов у каждого пользователя')
+        parser.add_argument(
+            '--cart', type=int, default=3,
+            help='Рецептов в корзине у каждого пользователя')
+        parser.add_argument(
+            '--follows', type=int, default=5,
+            help='Подписок у каждого пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counts = generate(
+            users=options['users'],
+            recipes=options['recipes'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            favorites=options['favorites'],
+            cart=options['cart'],
+            follows=options['follows'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        for model, count in counts.items():
+            self.stdout.write(f'{model}: {count}')
+        self.stdout.write(self.style.SUCCESS('Данные созданы!'))
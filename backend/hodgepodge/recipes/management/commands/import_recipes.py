@@ -0,0 +1,171 @@
+import json
+import sys
+from itertools import islice
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes.cache import bump_version
+from recipes.counters import recount
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Reads the NDJSON written by export_recipes.
+
+    Recipes are written batch by batch, each batch in its own
+    transaction. Recipes whose author already has one with the same name
+    are skipped, so an interrupted import can be re-run. Authors must
+    exist; unknown tags are dropped and unknown ingredients are created.
+    The creation date is restored when the export has one, so recipes
+    keep their order in the feeds. Image files are referenced by name
+    and have to be copied separately.
+    """
+    help = 'Загружаем рецепты из NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл с выгрузкой, по умолчанию stdin')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Рецептов в одной транзакции')
+
+    def handle(self, *args, **options):
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.values_list('pk', 'name', 'measurement_unit')
+        }
+        self.imported = self.skipped = 0
+        if options['path'] == '-':
+            self.load(sys.stdin, options['batch_size'])
+        else:
+            with open(options['path'], 'r', encoding='UTF-8') as file:
+                self.load(file, options['batch_size'])
+        bump_version(Recipe._meta.label_lower, Ingredient._meta.label_lower)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {self.imported}, '
+            f'пропущено: {self.skipped}'))
+
+    def load(self, file, batch_size):
+        rows = (
+            self.parse(number, line)
+            for number, line in enumerate(file, 1) if line.strip()
+        )
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            with transaction.atomic():
+                self.import_batch(batch)
+            self.stdout.write(
+                f'Загружено {self.imported}, пропущено {self.skipped}')
+
+    @staticmethod
+    def parse(number, line):
+        try:
+            return json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Строка {number}: {error}')
+
+    def import_batch(self, batch):
+        authors = dict(User.objects.filter(
+            email__in={row['author'] for row in batch},
+        ).values_list('email', 'pk'))
+        existing = set(Recipe.objects.filter(
+            author_id__in=authors.values(),
+            name__in={row['name'] for row in batch},
+        ).values_list('author_id', 'name'))
+        rows = []
+        for row in batch:
+            author_id = authors.get(row['author'])
+            if author_id is None or (author_id, row['name']) in existing:
+                self.skipped += 1
+                continue
+            existing.add((author_id, row['name']))
+            rows.append((author_id, row))
+        if not rows:
+            return
+        self.add_missing_ingredients([row for _, row in rows])
+        recipes = self.create_recipes(rows)
+        self.restore_created(recipes, [row for _, row in rows])
+        self.create_relations(recipes, [row for _, row in rows])
+        recount(
+            User.objects.filter(pk__in={pk for pk, _ in rows}),
+            'recipes_count', Recipe.objects.all(), 'author')
+        self.imported += len(rows)
+
+    def add_missing_ingredients(self, rows):
+        missing = {
+            (item['name'], item['measurement_unit'])
+            for row in rows for item in row['ingredients']
+        } - self.ingredients.keys()
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in missing),
+            ignore_conflicts=True)
+        for pk, name, unit in Ingredient.objects.filter(
+                name__in={name for name, _ in missing}).values_list(
+                'pk', 'name', 'measurement_unit'):
+            self.ingredients[(name, unit)] = pk
+
+    @staticmethod
+    def create_recipes(rows):
+        """Inserts the recipes and returns them in the order of rows."""
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author_id=author_id,
+                name=row['name'],
+                text=row['text'],
+                cooking_time=row['cooking_time'],
+                image=row['image'],
+            )
+            for author_id, row in rows
+        )
+        if all(recipe.pk for recipe in recipes):
+            return recipes
+        # Backends that cannot return ids from a bulk insert.
+        ids = {
+            (author_id, name): pk
+            for pk, author_id, name in Recipe.objects.filter(
+                author_id__in={author_id for author_id, _ in rows},
+                name__in={row['name'] for _, row in rows},
+            ).values_list('pk', 'author_id', 'name')
+        }
+        for recipe in recipes:
+            recipe.pk = ids[(recipe.author_id, recipe.name)]
+        return recipes
+
+    @staticmethod
+    def restore_created(recipes, rows):
+        """created is auto_now_add, so bulk_create sets it to now; one
+        bulk_update brings back the exported dates."""
+        dated = []
+        for recipe, row in zip(recipes, rows):
+            created = parse_datetime(row.get('created') or '')
+            if created is not None:
+                recipe.created = created
+                dated.append(recipe)
+        Recipe.objects.bulk_update(dated, ['created'])
+
+    def create_relations(self, recipes, rows):
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe_id=recipe.pk,
+                ingredient_id=self.ingredients[
+                    (item['name'], item['measurement_unit'])],
+                amount=item['amount'],
+            )
+            for recipe, row in zip(recipes, rows)
+            for item in row['ingredients']
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=self.tags[slug])
+            for recipe, row in zip(recipes, rows)
+            for slug in row['tags'] if slug in self.tags
+        )
@@ -1,19 +1,137 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
 
-from csv import reader
-
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from recipes.cache import bump_version
 from recipes.models import Ingredient
 
+READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if len(row) == 2:
+            yield row[0], row[1]
+
+
+def iter_json(file):
+    """Items of a top-level JSON array, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON массив')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError('Файл JSON обрывается')
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item['name'], item['measurement_unit']
+
 
 class Command(BaseCommand):
-    """Loads ingredients.csv data"""
-    def handle(self, *args, **kwargs):
-        with open(
-                'data/ingredients.csv', 'r', encoding='UTF-8') as ingredients:
-            for row in reader(ingredients):
-                if len(row) == 2:
-                    Ingredient.objects.get_or_create(
-                        name=row[0], measurement_unit=row[1],
-                    )
-        self.stdout.write(self.style.SUCCESS('Все индигриенты загружены!'))
+    """Loads ingredients from data/ingredients.csv or a JSON array of
+    {"name": ..., "measurement_unit": ...}.
+
+    Rows are de-duplicated in memory and inserted in batches inside one
+    transaction; ingredients that already exist are skipped, so the
+    command can be re-run.
+    """
+    help = 'Загружаем ингредиенты из CSV или JSON'
+    readers = {'.csv': iter_csv, '.json': iter_json}
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='data/ingredients.csv',
+            help='Файл .csv или .json')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Строк в одной вставке')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        read = self.readers.get(os.path.splitext(path)[1].lower())
+        if read is None:
+            raise CommandError('Поддерживаются только .csv и .json')
+        before = Ingredient.objects.count()
+        with open(path, 'r', encoding='UTF-8') as file:
+            rows = self.unique(read(file))
+            with transaction.atomic():
+                for total in self.load(rows, options['batch_size']):
+                    self.stdout.write(f'Обработано строк: {total}')
+        added = Ingredient.objects.count() - before
+        bump_version(Ingredient._meta.label_lower)
+        self.stdout.write(self.style.SUCCESS(
+            f'Все индигриенты загружены! Новых: {added}'))
+
+    @staticmethod
+    def unique(rows):
+        seen = set()
+        for name, measurement_unit in rows:
+            row = (name.strip(), measurement_unit.strip())
+            if row[0] and row not in seen:
+                seen.add(row)
+                yield row
+
+    def load(self, rows, batch_size):
+        """Writes the rows batch by batch and yields the running total."""
+        write = self.bulk_create
+        if connection.vendor == 'postgresql':
+            self.create_copy_table()
+            write = self.copy
+        total = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            write(batch)
+            total += len(batch)
+            yield total
+
+    @staticmethod
+    def bulk_create(batch):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch
+            ),
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def create_copy_table():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_load '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP')
+
+    @staticmethod
+    def copy(batch):
+        """COPY the batch into a temporary table and move it over with
+        INSERT ... ON CONFLICT DO NOTHING."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                'COPY ingredient_load FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredient_load '
+                'ON CONFLICT DO NOTHING')
+            cursor.execute('TRUNCATE ingredient_load')
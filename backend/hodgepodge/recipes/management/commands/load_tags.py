@@ -1,5 +1,6 @@
 from django.core.management import BaseCommand
 
+from recipes.cache import bump_version
 from recipes.models import Tag
 
 
@@ -11,5 +12,10 @@ class Command(BaseCommand):
             {'name': 'Завтрак', 'color': '#c90076', 'slug': 'breakfast'},
             {'name': 'Обед', 'color': '#49B64E', 'slug': 'dinner'},
             {'name': 'Ужин', 'color': '#7c12e1', 'slug': 'supper'}]
-        Tag.objects.bulk_create(Tag(**tag) for tag in data)
-        self.stdout.write(self.style.SUCCESS('Все тэги загружены!'))
+        before = Tag.objects.count()
+        Tag.objects.bulk_create(
+            (Tag(**tag) for tag in data), ignore_conflicts=True)
+        added = Tag.objects.count() - before
+        bump_version(Tag._meta.label_lower)
+        self.stdout.write(self.style.SUCCESS(
+            f'Все тэги загружены! Новых: {added}'))
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from recipes.images import render_variants, store_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаем уменьшенные и WebP копии картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.IMAGE_VARIANT_WORKERS or os.cpu_count(),
+            help='Число процессов')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать и уже готовые копии')
+
+    def handle(self, *args, **options):
+        pending = [
+            (pk, name)
+            for pk, name, variants in Recipe.objects.exclude(
+                image='').values_list('pk', 'image', 'image_variants')
+            if options['force'] or variants.get('source') != name
+        ]
+        self.stdout.write(f'Картинок к обработке: {len(pending)}')
+        failed = 0
+        with ProcessPoolExecutor(
+                max_workers=max(options['workers'], 1),
+                initializer=django.setup) as executor:
+            futures = {
+                executor.submit(
+                    render_variants, name, options['force']): (pk, name)
+                for pk, name in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                pk, name = futures[future]
+                try:
+                    store_variants(pk, name, future.result())
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                if done % 100 == 0:
+                    self.stdout.write(f'Обработано {done} из {len(pending)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово! Ошибок: {failed}'))
@@ -0,0 +1,53 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import IngredientAmount, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Сверяем и пересобираем списки покупок по корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сообщить о расхождениях, ничего не меняя')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = {
+                (row['recipe__cart__author'], row['ingredient']): row['total']
+                for row in IngredientAmount.objects.cart_totals().iterator()
+            }
+            stored = dict(
+                ((user_id, ingredient_id), total)
+                for user_id, ingredient_id, total
+                in ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount').iterator()
+            )
+            missing = expected.keys() - stored.keys()
+            extra = stored.keys() - expected.keys()
+            wrong = [
+                key for key in expected.keys() & stored.keys()
+                if expected[key] != stored[key]
+            ]
+            self.stdout.write(
+                f'Нет в списке: {len(missing)}, лишних: {len(extra)}, '
+                f'с неверным количеством: {len(wrong)}')
+            if not (missing or extra or wrong):
+                self.stdout.write(self.style.SUCCESS('Списки покупок верны'))
+                return
+            if options['check']:
+                raise CommandError('Списки покупок расходятся с корзинами')
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total,
+                    )
+                    for (user_id, ingredient_id), total in expected.items()
+                ),
+                batch_size=1000,
+            )
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны!'))
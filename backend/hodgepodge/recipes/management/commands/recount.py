@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитываем счетчики избранного, покупок, рецептов и подписчиков'
+
+    counters = (
+        (Recipe, 'favorites_count', Favorite, 'recipe'),
+        (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count', Follow, 'author'),
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        for model, field, related, related_field in self.counters:
+            fixed = recount(
+                model.objects.all(), field, related.objects.all(),
+                related_field)
+            self.stdout.write(f'{model.__name__}.{field}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны!'))
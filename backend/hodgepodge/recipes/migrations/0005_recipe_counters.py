@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 06:01
+
+from django.db import migrations, models
+
+from recipes.counters import recount
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    recount(Recipe.objects.all(), 'favorites_count',
+            Favorite.objects.all(), 'recipe')
+    recount(Recipe.objects.all(), 'cart_count',
+            ShoppingCart.objects.all(), 'recipe')
+    recount(User.objects.all(), 'recipes_count',
+            Recipe.objects.all(), 'author')
+    recount(User.objects.all(), 'followers_count',
+            Follow.objects.all(), 'author')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_updated'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
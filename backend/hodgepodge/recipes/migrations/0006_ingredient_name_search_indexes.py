@@ -0,0 +1,54 @@
+from django.db import DatabaseError, migrations, transaction
+
+TRIGRAM_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)')
+PREFIX_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)')
+
+
+def has_trigrams(connection):
+    """Whether pg_trgm is installed or this role may install it.
+
+    CREATE EXTENSION needs superuser or CREATE rights on the database;
+    without them the trigram index is skipped and substring search reads
+    the table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone():
+            return True
+        try:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute('CREATE EXTENSION pg_trgm')
+        except DatabaseError:
+            return False
+    return True
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    if has_trigrams(schema_editor.connection):
+        schema_editor.execute(TRIGRAM_INDEX)
+    schema_editor.execute(PREFIX_INDEX)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
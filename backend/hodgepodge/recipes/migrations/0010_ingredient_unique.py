@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+MERGED = (
+    ('IngredientAmount', 'recipe_id', 'amount'),
+    ('ShoppingListItem', 'user_id', 'total_amount'),
+)
+
+
+def merge_duplicates(apps, schema_editor):
+    """Folds ingredients with the same name and unit into the oldest one,
+    summing amounts that end up on the same recipe or shopping list."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit',
+    ).annotate(
+        keep=models.Min('id'), total=models.Count('id'),
+    ).filter(total__gt=1).order_by()
+    for group in duplicates:
+        extra = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit'],
+        ).exclude(pk=group['keep']).values_list('pk', flat=True))
+        for model_name, owner, field in MERGED:
+            model = apps.get_model('recipes', model_name)
+            for row in model.objects.filter(ingredient_id__in=extra):
+                kept = model.objects.filter(
+                    **{owner: getattr(row, owner)},
+                    ingredient_id=group['keep']).first()
+                if kept is None:
+                    row.ingredient_id = group['keep']
+                    row.save(update_fields=['ingredient'])
+                    continue
+                setattr(
+                    kept, field, getattr(kept, field) + getattr(row, field))
+                kept.save(update_fields=[field])
+                row.delete()
+        Ingredient.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
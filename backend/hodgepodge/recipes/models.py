@@ -1,7 +1,12 @@
 from django.core import validators
-from django.db import models
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
-from users.models import User
+from users.models import Follow, User
+
+from .storage import ContentAddressedStorage
 
 
 class Ingredient(models.Model):
@@ -21,6 +26,10 @@ class Ingredient(models.Model):
         ordering = ['id']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient')]
 
     def __str__(self):
         return self.name
@@ -63,6 +72,72 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Query helpers shared by the recipe endpoints."""
+
+    def with_user_flags(self, user):
+        """Annotates is_favorited, is_in_shopping_cart and
+        author_is_subscribed for the user."""
+        if user.is_anonymous:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                author=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                author=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                user=user, author=models.OuterRef('author'))),
+        )
+
+    def for_representation(self, user):
+        """What RecipeListSerializer needs up front.
+
+        Tags and ingredients are prefetched by the serializer, and only
+        for recipes whose representation is not cached yet.
+        """
+        return self.select_related('author').with_user_flags(user)
+
+    @staticmethod
+    def representation_prefetch(fields=('tags', 'ingredients')):
+        """Prefetch lookups for the given representation fields."""
+        lookups = {
+            'tags': models.Prefetch('tags', queryset=Tag.objects.all()),
+            'ingredients': models.Prefetch(
+                'amount',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient')),
+        }
+        return [lookups[name] for name in fields if name in lookups]
+
+    def latest_per_author(self, author_ids, limit=None):
+        """The latest `limit` recipes of each author, all in one query.
+
+        Recipes are ranked with ROW_NUMBER() per author in a subquery;
+        Django cannot filter on a window expression directly.
+        """
+        recipes = self.filter(author_id__in=author_ids)
+        if limit is None:
+            return recipes
+        ranked = recipes.order_by().annotate(recipe_rank=models.Window(
+            expression=RowNumber(),
+            partition_by=[models.F('author_id')],
+            order_by=[models.F('created').desc(), models.F('id').desc()],
+        )).values('pk', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        return recipes.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE recipe_rank <= %s',
+            (*params, limit)))
+
+    def touch(self):
+        """Marks the recipes as changed for cached representations."""
+        return self.update(updated=timezone.now())
+
+
 class Recipe(models.Model):
     """Represents Recipes."""
 
@@ -79,6 +154,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=ContentAddressedStorage(),
         verbose_name='Изображение'
     )
     text = models.TextField(
@@ -103,6 +179,28 @@ class Recipe(models.Model):
         auto_now_add=True,
         help_text="Автоматически устанавливается текущая дата и время",
     )
+    updated = models.DateTimeField(
+        "Дата изменения",
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False,
+    )
+    image_variants = models.JSONField(
+        'Уменьшенные изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',)
@@ -113,11 +211,29 @@ class Recipe(models.Model):
             models.UniqueConstraint(
                 fields=['name', 'author'],
                 name='unique_recipe')]
+        indexes = [
+            models.Index(
+                fields=['-created', '-id'],
+                name='recipe_created_id_idx')]
 
     def __str__(self):
         return self.name
 
 
+class IngredientAmountQuerySet(models.QuerySet):
+
+    def cart_totals(self):
+        """Total amount of every ingredient per shopping cart owner."""
+        return self.filter(recipe__cart__isnull=False).values(
+            'recipe__cart__author', 'ingredient',
+        ).annotate(total=models.Sum('amount')).order_by()
+
+    def amounts(self):
+        """{ingredient id: total amount} of the selected rows."""
+        return dict(self.order_by().values('ingredient').annotate(
+            total=models.Sum('amount')).values_list('ingredient', 'total'))
+
+
 class IngredientAmount(models.Model):
     """Intermediate Model for Recipes and Ingredients."""
     ingredient = models.ForeignKey(
@@ -139,6 +255,8 @@ class IngredientAmount(models.Model):
         )
     )
 
+    objects = IngredientAmountQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Состав рецепта'
         verbose_name_plural = 'Состав рецепта'
@@ -148,9 +266,68 @@ class IngredientAmount(models.Model):
         ]
 
 
+class UserListQuerySet(models.QuerySet):
+    """Favorites and carts: rows of (author, recipe)."""
+
+    def add_recipes(self, user, recipe_ids):
+        """Inserts the missing rows, returns the ids of the added recipes.
+
+        On PostgreSQL the ids come from INSERT ... ON CONFLICT DO NOTHING
+        RETURNING, so requests running side by side never count the same
+        row twice.
+        """
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        if connections[self.db].vendor == 'postgresql':
+            return self.returning(
+                'INSERT INTO {table} (author_id, recipe_id) '
+                'SELECT %s, unnest(%s::integer[]) '
+                'ON CONFLICT (author_id, recipe_id) DO NOTHING '
+                'RETURNING recipe_id', [user.pk, recipe_ids])
+        added = set(recipe_ids) - set(self.filter(
+            author=user, recipe_id__in=recipe_ids,
+        ).values_list('recipe_id', flat=True))
+        self.bulk_create(
+            [self.model(author=user, recipe_id=pk) for pk in added],
+            ignore_conflicts=True)
+        return added
+
+    def remove_recipes(self, user, recipe_ids):
+        """Deletes the rows, returns the ids of the removed recipes.
+
+        On PostgreSQL this is one DELETE ... RETURNING, which sends no
+        post_delete signals: callers update the counters and the
+        shopping list themselves.
+        """
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        if connections[self.db].vendor == 'postgresql':
+            return self.returning(
+                'DELETE FROM {table} '
+                'WHERE author_id = %s AND recipe_id = ANY(%s::integer[]) '
+                'RETURNING recipe_id', [user.pk, recipe_ids])
+        rows = self.filter(author=user, recipe_id__in=recipe_ids)
+        removed = set(rows.values_list('recipe_id', flat=True))
+        rows.filter(recipe_id__in=removed).delete()
+        return removed
+
+    def returning(self, sql, params):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=table), params)
+            return {row[0] for row in cursor.fetchall()}
+
+
 class Favorite(models.Model):
     """Represents Favourite Recipes."""
 
+    counter_field = 'favorites_count'
+
+    objects = UserListQuerySet.as_manager()
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -179,6 +356,10 @@ class Favorite(models.Model):
 class ShoppingCart(models.Model):
     """Represents Ingredients in the Shopping Cart."""
 
+    counter_field = 'cart_count'
+
+    objects = UserListQuerySet.as_manager()
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -201,3 +382,131 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'Рецепт {self.recipe} в списке покупок у {self.author}'
+
+
+class ShoppingListQuerySet(models.QuerySet):
+
+    def add_amounts(self, user_ids, deltas):
+        """Adds {ingredient id: delta} to the shopping lists of the users.
+
+        Rows that reach zero are removed. Call inside the transaction
+        that changes the carts or the recipe ingredients. On PostgreSQL
+        new rows go through an upsert; other databases check which rows
+        exist first, which is safe as long as they serialize writes.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        items = self.filter(user_id__in=user_ids)
+        added = {pk: delta for pk, delta in deltas.items() if delta > 0}
+        if connections[self.db].vendor == 'postgresql':
+            if len(added) < len(deltas):
+                items.change_totals({
+                    pk: delta for pk, delta in deltas.items() if delta < 0})
+            if added:
+                self.upsert(user_ids, added)
+        else:
+            existing = set(items.filter(ingredient_id__in=added).values_list(
+                'user_id', 'ingredient_id'))
+            items.change_totals(deltas)
+            self.bulk_create(
+                ShoppingListItem(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=delta,
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in added.items()
+                if (user_id, ingredient_id) not in existing
+            )
+        if len(added) < len(deltas):
+            items.filter(total_amount__lte=0).delete()
+
+    def change_totals(self, deltas):
+        """Adds {ingredient id: delta} to the selected rows."""
+        return self.filter(ingredient_id__in=deltas).update(
+            total_amount=models.F('total_amount') + models.Case(
+                *(models.When(ingredient_id=pk, then=models.Value(delta))
+                  for pk, delta in deltas.items()),
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            ))
+
+    def upsert(self, user_ids, added):
+        """Adds the amounts with one INSERT ... ON CONFLICT DO UPDATE, so
+        concurrent writes to the same list never hit the unique
+        constraint."""
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, total_amount) '
+                'SELECT users.id, deltas.ingredient_id, deltas.amount '
+                'FROM unnest(%s::integer[]) AS users(id) '
+                'CROSS JOIN unnest(%s::integer[], %s::integer[]) '
+                'AS deltas(ingredient_id, amount) '
+                'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                f'SET total_amount = {table}.total_amount '
+                '+ EXCLUDED.total_amount',
+                [user_ids, list(added), list(added.values())])
+
+
+class ShoppingListItem(models.Model):
+    """Ingredient totals of a user's shopping cart.
+
+    Maintained together with ShoppingCart so the shopping list download
+    is a plain indexed read.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Список покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_list_item')]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount}'
+
+
+class CollectionVersion(models.Model):
+    """Version stamp of a collection, see recipes.cache.
+
+    Kept in the database so writes from any process, management commands
+    included, change the validators every worker hands out.
+    """
+
+    name = models.CharField(
+        max_length=150,
+        unique=True,
+        verbose_name='Коллекция',
+    )
+    stamp = models.BigIntegerField(
+        verbose_name='Версия',
+    )
+
+    class Meta:
+        verbose_name = 'Версия коллекции'
+        verbose_name_plural = 'Версии коллекций'
+
+    def __str__(self):
+        return f'{self.name}: {self.stamp}'
@@ -0,0 +1,243 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.models import Follow, User
+
+from .cache import bump_version, user_version_name
+from .images import schedule_variants
+from .models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                     ShoppingCart, ShoppingListItem, Tag)
+
+RECIPES = Recipe._meta.label_lower
+TAGS = Tag._meta.label_lower
+INGREDIENTS = Ingredient._meta.label_lower
+FOLLOWS = Follow._meta.label_lower
+USERS = User._meta.label_lower
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+_bulk_write = ContextVar('recipes_bulk_write', default=None)
+
+
+class BulkWrite:
+    """Changes collected while the row-level receivers are silenced."""
+
+    def __init__(self):
+        self.recipe_ids = set()
+        self.versions = set()
+
+    def flush(self):
+        if self.recipe_ids:
+            recipes_changed(Recipe.objects.filter(pk__in=self.recipe_ids))
+        if self.versions:
+            bump_version(*self.versions)
+
+
+@contextmanager
+def bulk_write():
+    """Silences the row-level receivers for code that writes in bulk.
+
+    The shopping list is left to the caller, which updates it with one
+    add_amounts call. Recipes to touch and user stamps to bump are
+    collected and written once when the block exits, instead of once
+    per changed row.
+    """
+    batch = BulkWrite()
+    token = _bulk_write.set(batch)
+    try:
+        yield batch
+    finally:
+        _bulk_write.reset(token)
+    batch.flush()
+
+
+def recipes_changed(recipes):
+    recipes.touch()
+    bump_version(RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    batch = _bulk_write.get()
+    if batch:
+        # The save has already set Recipe.updated.
+        batch.recipe_ids.discard(instance.pk)
+    bump_version(RECIPES)
+    name = instance.image.name
+    if name and instance.image_variants.get('source') != name:
+        transaction.on_commit(partial(schedule_variants, instance.pk, name))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    batch = _bulk_write.get()
+    if batch:
+        batch.recipe_ids.discard(instance.pk)
+    bump_version(RECIPES)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_clear':
+        bump_version(RECIPES)
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    batch = _bulk_write.get()
+    if batch and not reverse:
+        batch.recipe_ids.add(instance.pk)
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif pk_set:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    else:
+        recipes = Recipe.objects.filter(tags=instance)
+    recipes_changed(recipes)
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    batch = _bulk_write.get()
+    if batch:
+        batch.recipe_ids.add(instance.recipe_id)
+        return
+    recipes_changed(Recipe.objects.filter(pk=instance.recipe_id))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    bump_version(TAGS)
+    if not created:
+        recipes_changed(Recipe.objects.filter(tags=instance))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    bump_version(INGREDIENTS)
+    if not created:
+        recipes_changed(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def user_list_changed(sender, instance, **kwargs):
+    name = user_version_name(instance.author_id)
+    batch = _bulk_write.get()
+    if batch:
+        batch.versions.add(name)
+    else:
+        bump_version(name)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    bump_version(FOLLOWS, user_version_name(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        bump_version(USERS)
+    elif update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        recipes_changed(Recipe.objects.filter(author=instance))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_version(USERS)
+
+
+# Shopping lists for writes that bypass the API: the admin, plain ORM
+# calls and cascades. Deletions are handled after the fact and only
+# against rows that still exist, so when a cascade removes both the cart
+# rows and the ingredient rows of a recipe every (cart, ingredient) pair
+# is subtracted exactly once, whichever table goes first.
+
+def cart_users(recipe_id):
+    return list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('author_id', flat=True))
+
+
+def previous_values(sender, instance, *fields):
+    """The row as stored before this save, or None for a new one."""
+    if _bulk_write.get() or instance.pk is None:
+        return None
+    return sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+def add_recipe_amounts(user_ids, recipe_id, sign):
+    amounts = IngredientAmount.objects.filter(recipe_id=recipe_id).amounts()
+    ShoppingListItem.objects.add_amounts(
+        user_ids, {pk: sign * amount for pk, amount in amounts.items()})
+
+
+@receiver(pre_save, sender=ShoppingCart)
+def cart_saving(sender, instance, **kwargs):
+    instance.previous = previous_values(
+        sender, instance, 'author_id', 'recipe_id')
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_saved(sender, instance, **kwargs):
+    if _bulk_write.get():
+        return
+    current = (instance.author_id, instance.recipe_id)
+    previous = getattr(instance, 'previous', None)
+    if previous == current:
+        return
+    if previous:
+        add_recipe_amounts([previous[0]], previous[1], -1)
+    add_recipe_amounts([instance.author_id], instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_deleted(sender, instance, **kwargs):
+    if not _bulk_write.get():
+        add_recipe_amounts([instance.author_id], instance.recipe_id, -1)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def ingredient_amount_saving(sender, instance, **kwargs):
+    instance.previous = previous_values(
+        sender, instance, 'recipe_id', 'ingredient_id', 'amount')
+
+
+@receiver(post_save, sender=IngredientAmount)
+def ingredient_amount_saved(sender, instance, **kwargs):
+    if _bulk_write.get():
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    if getattr(instance, 'previous', None):
+        recipe_id, ingredient_id, amount = instance.previous
+        deltas[recipe_id][ingredient_id] -= amount
+    deltas[instance.recipe_id][instance.ingredient_id] += instance.amount
+    for recipe_id, changes in deltas.items():
+        ShoppingListItem.objects.add_amounts(cart_users(recipe_id), changes)
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def ingredient_amount_deleted(sender, instance, **kwargs):
+    if not _bulk_write.get():
+        ShoppingListItem.objects.add_amounts(
+            cart_users(instance.recipe_id),
+            {instance.ingredient_id: -instance.amount})
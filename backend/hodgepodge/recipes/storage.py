@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores files under the sha256 of their content.
+
+    Saving a file that is already stored only refreshes its modification
+    time, so uploading the same image again reuses the existing file.
+    Files may be shared by several rows and are never deleted with them;
+    orphans are removed by the collect_images command.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, self.get_digest(content) + ext)
+        try:
+            # A fresh mtime keeps collect_images off a reused file until
+            # the row that refers to it is committed.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super().save(name, content, max_length)
+        return name
+
+    @staticmethod
+    def get_digest(content):
+        """Uploads hashed while being received carry a sha256 attribute."""
+        digest = getattr(content, 'sha256', None)
+        if digest:
+            return digest
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
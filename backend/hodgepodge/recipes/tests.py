@@ -0,0 +1,158 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from users.models import User
+
+from .models import (Ingredient, IngredientAmount, Recipe, ShoppingCart,
+                     ShoppingListItem)
+from .storage import ContentAddressedStorage
+
+
+class ShoppingListSignalsTest(TestCase):
+    """Writes outside the API keep the shopping lists in line with the
+    carts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя', last_name='Фамилия',
+                password='password-123')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[number % 2], name=f'рецепт {number}',
+                text='текст', cooking_time=10, image='recipes/x.png')
+            for number in range(3)
+        ]
+        for recipe in cls.recipes:
+            for amount, ingredient in enumerate(cls.ingredients, 1):
+                IngredientAmount.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+        for user in cls.users:
+            for recipe in cls.recipes[:2]:
+                ShoppingCart.objects.create(author=user, recipe=recipe)
+
+    def assert_lists_match_carts(self):
+        out = io.StringIO()
+        call_command('rebuild_shopping_lists', '--check', stdout=out)
+        self.assertIn('Списки покупок верны', out.getvalue())
+
+    def test_cart_rows(self):
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.users[0], ingredient=self.ingredients[2],
+            ).total_amount, 6)
+        ShoppingCart.objects.create(
+            author=self.users[0], recipe=self.recipes[2])
+        ShoppingCart.objects.filter(author=self.users[1]).delete()
+        cart = ShoppingCart.objects.get(
+            author=self.users[2], recipe=self.recipes[0])
+        cart.recipe = self.recipes[2]
+        cart.save()
+        self.assert_lists_match_carts()
+        self.assertFalse(self.users[1].shopping_list.exists())
+
+    def test_ingredient_rows(self):
+        row = IngredientAmount.objects.get(
+            recipe=self.recipes[0], ingredient=self.ingredients[0])
+        row.amount = 50
+        row.save()
+        IngredientAmount.objects.get(
+            recipe=self.recipes[1], ingredient=self.ingredients[3]).delete()
+        row = IngredientAmount.objects.get(
+            recipe=self.recipes[1], ingredient=self.ingredients[1])
+        row.ingredient = self.ingredients[3]
+        row.save()
+        IngredientAmount.objects.filter(
+            ingredient=self.ingredients[2]).delete()
+        self.assert_lists_match_carts()
+
+    def test_cascades(self):
+        Recipe.objects.filter(pk=self.recipes[0].pk).delete()
+        self.assert_lists_match_carts()
+        self.users[1].delete()
+        self.assert_lists_match_carts()
+        self.ingredients[3].delete()
+        self.assert_lists_match_carts()
+
+
+class ContentAddressedStorageTest(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = ContentAddressedStorage(location=self.root)
+
+    def make_old(self, name, hours=48):
+        old = time.time() - hours * 3600
+        os.utime(self.storage.path(name), (old, old))
+
+    def test_reuse_refreshes_modified_time(self):
+        name = self.storage.save('recipes/a.png', ContentFile(b'image'))
+        self.make_old(name)
+        self.assertEqual(
+            self.storage.save('recipes/b.png', ContentFile(b'image')), name)
+        self.assertGreater(
+            os.path.getmtime(self.storage.path(name)), time.time() - 60)
+
+    def test_collect_images_keeps_reused_files(self):
+        with override_settings(MEDIA_ROOT=self.root):
+            orphan = self.storage.save(
+                'recipes/orphan.png', ContentFile(b'orphan'))
+            reused = self.storage.save(
+                'recipes/reused.png', ContentFile(b'reused'))
+            self.make_old(orphan)
+            self.make_old(reused)
+            self.storage.save('recipes/again.png', ContentFile(b'reused'))
+            call_command('collect_images', stdout=io.StringIO())
+            self.assertFalse(default_storage.exists(orphan))
+            self.assertTrue(default_storage.exists(reused))
+
+
+class ExportImportTest(TestCase):
+
+    def test_round_trip_keeps_created(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password-123')
+        ingredient = Ingredient.objects.create(
+            name='ингредиент', measurement_unit='г')
+        dates = {}
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=author, name=f'рецепт {number}', text='текст',
+                cooking_time=10, image='recipes/x.png')
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=number + 1)
+            created = timezone.now() - timedelta(days=30 * (number + 1))
+            Recipe.objects.filter(pk=recipe.pk).update(created=created)
+            dates[recipe.name] = created
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'recipes.ndjson')
+            call_command('export_recipes', '-o', path, stdout=io.StringIO())
+            Recipe.objects.all().delete()
+            call_command('import_recipes', path, stdout=io.StringIO())
+        self.assertEqual(
+            dict(Recipe.objects.values_list('name', 'created')), dates)
+        self.assertEqual(
+            IngredientAmount.objects.filter(
+                recipe__name='рецепт 2').get().amount, 3)
@@ -12,6 +12,8 @@ class UserAdmin(BaseUserAdmin):
                     'email',
                     'first_name',
                     'last_name',
+                    'recipes_count',
+                    'followers_count',
                     )
     list_filter = ('username', 'email')
 
@@ -1,12 +1,13 @@
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 
+from api.mixins import SparseFieldsetMixin
 from api.utils import Base64ImageField
 from recipes.models import Recipe
 from users.models import Follow, User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Converts Users' data."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -18,6 +19,8 @@ class UserSerializer(serializers.ModelSerializer):
                         'is_subscribed': {'read_only': True}}
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (
             False
@@ -37,7 +40,7 @@ class RecipeShortSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'cooking_time', 'image')
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     email = serializers.ReadOnlyField(source='author.email')
     id = serializers.ReadOnlyField(source='author.id')
     username = serializers.ReadOnlyField(source='author.username')
@@ -54,22 +57,29 @@ class FollowSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
-        if not user.is_anonymous:
-            return Follow.objects.filter(
-                user=obj.user,
-                author=obj.author).exists()
-        return False
-
-    def get_recipes(self, obj):
-        request = self.context.get('request')
+        if user.is_anonymous:
+            return False
+        if obj.user_id == user.id:
+            return True
+        return Follow.objects.filter(user=user, author=obj.author).exists()
+
+    @staticmethod
+    def get_recipes_limit(request):
         limit = request.GET.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj.author)
         if limit and limit.isdigit():
-            recipes = recipes[:int(limit)]
+            return int(limit)
+        return None
+
+    def get_recipes(self, obj):
+        """Uses author.latest_recipes when the view has prefetched them."""
+        recipes = getattr(obj.author, 'latest_recipes', None)
+        if recipes is None:
+            limit = self.get_recipes_limit(self.context.get('request'))
+            recipes = Recipe.objects.filter(author=obj.author)[:limit]
         return RecipeShortSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.recipes_count
 
     def validate(self, data):
         author = self.context.get('author')
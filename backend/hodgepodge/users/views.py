@@ -1,3 +1,6 @@
+from django.db import transaction
+from django.db.models import (Exists, OuterRef, Prefetch,
+                              prefetch_related_objects)
 from django.shortcuts import get_object_or_404
 from djoser.serializers import SetPasswordSerializer
 from rest_framework import status, viewsets
@@ -7,6 +10,8 @@ from rest_framework.response import Response
 
 from api.pagination import CustomPagination
 from api.permissions import IsCurrentUserOrAdminOrReadOnly
+from recipes.counters import change_counter
+from recipes.models import Recipe
 from users.models import Follow, User
 from users.serializers import FollowSerializer, UserSerializer
 
@@ -16,7 +21,24 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = (IsCurrentUserOrAdminOrReadOnly, )
     pagination_class = CustomPagination
+    cursor_ordering = ('-id', )
     serializer_class = UserSerializer
+    query_budgets = {
+        'list': 5,
+        'retrieve': 3,
+        'create': 4,
+        'me': 3,
+        'set_password': 4,
+        'subscribe': 8,
+        'subscriptions': 6,
+    }
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_anonymous:
+            return User.objects.all()
+        return User.objects.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))))
 
     @action(detail=False,
             methods=['get'],
@@ -54,13 +76,21 @@ class UserViewSet(viewsets.ModelViewSet):
                 data=request.data,
                 context={'request': request, 'author': author})
             if serializer.is_valid(raise_exception=True):
-                serializer.save(author=author, user=user)
+                with transaction.atomic():
+                    serializer.save(author=author, user=user)
+                    change_counter(User.objects.filter(pk=author.pk),
+                                   'followers_count', 1)
                 return Response({'Subscription is created': serializer.data},
                                 status=status.HTTP_201_CREATED)
             return Response({'errors': 'No object found'},
                             status=status.HTTP_404_NOT_FOUND)
-        if Follow.objects.filter(author=author, user=user).exists():
-            Follow.objects.get(author=author).delete()
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                author=author, user=user).delete()
+            if deleted:
+                change_counter(User.objects.filter(pk=author.pk),
+                               'followers_count', -1)
+        if deleted:
             return Response('Unfollowed',
                             status=status.HTTP_204_NO_CONTENT)
         return Response({'errors': 'No object found'},
@@ -70,9 +100,23 @@ class UserViewSet(viewsets.ModelViewSet):
             methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        """Displays all the user's subscriptions."""
-        follow = Follow.objects.filter(user=self.request.user)
-        display = self.paginate_queryset(follow)
+        """Displays all the user's subscriptions.
+
+        The page costs the same number of queries whatever the number of
+        authors on it and recipes_limit: authors are joined, recipe counts
+        come from the counter and the recipes of all authors are loaded
+        in one query.
+        """
+        follows = Follow.objects.filter(
+            user=self.request.user).select_related('author')
+        display = self.paginate_queryset(follows)
+        authors = [follow.author for follow in display]
+        prefetch_related_objects(authors, Prefetch(
+            'recipes',
+            queryset=Recipe.objects.latest_per_author(
+                [author.pk for author in authors],
+                FollowSerializer.get_recipes_limit(request)),
+            to_attr='latest_recipes'))
         serializer = FollowSerializer(display,
                                       many=True,
                                       context={'request': request})